@@ -27,4 +27,39 @@ LANGUAGE_CODE = os.getenv('LANGUAGE_CODE')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 MAX_RESPONSE_LENGTH = int(os.getenv('MAX_RESPONSE_LENGTH'))
 WEBHOOK_URL = f"{os.getenv('WEBHOOK_URL')}/{TELEGRAM_TOKEN}"
-MODEL = os.getenv('MODEL')
\ No newline at end of file
+MODEL = os.getenv('MODEL')
+# Number of Telegram updates processed concurrently
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+# Maximum number of in-flight Dialogflow detect_intent calls
+DETECT_INTENT_CONCURRENCY = int(os.getenv('DETECT_INTENT_CONCURRENCY', 20))
+# Maximum number of concurrent Gemini calls per media type
+IMAGE_CONCURRENCY = int(os.getenv('IMAGE_CONCURRENCY', 8))
+VIDEO_CONCURRENCY = int(os.getenv('VIDEO_CONCURRENCY', 2))
+AUDIO_CONCURRENCY = int(os.getenv('AUDIO_CONCURRENCY', 4))
+# Media downloads
+MAX_DOWNLOAD_BYTES = int(os.getenv('MAX_DOWNLOAD_BYTES', 20 * 1024 * 1024))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 100))
+DNS_CACHE_TTL = int(os.getenv('DNS_CACHE_TTL', 300))
+# Image preprocessing
+IMAGE_TARGET_SIDE = int(os.getenv('IMAGE_TARGET_SIDE', 1024))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+IMAGE_CACHE_BYTES = int(os.getenv('IMAGE_CACHE_BYTES', 64 * 1024 * 1024))
+# Media reduction
+MEDIA_INLINE_MAX_BYTES = int(os.getenv('MEDIA_INLINE_MAX_BYTES', 8 * 1024 * 1024))
+VIDEO_SAMPLE_FPS = float(os.getenv('VIDEO_SAMPLE_FPS', 1.0))
+VIDEO_MAX_FRAMES = int(os.getenv('VIDEO_MAX_FRAMES', 60))
+AUDIO_TRANSCODE_MIN_BYTES = int(os.getenv('AUDIO_TRANSCODE_MIN_BYTES', 1024 * 1024))
+AUDIO_SAMPLE_RATE = int(os.getenv('AUDIO_SAMPLE_RATE', 16000))
+# Gemini rate limiting and retries. Each process has its own limiter, so this is its
+# share of the project quota: half by default, the webhook uses the other half
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', 30))
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', 5))
+GEMINI_MAX_ATTEMPTS = int(os.getenv('GEMINI_MAX_ATTEMPTS', 3))
+# Stream Gemini responses into progressively edited Telegram messages
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
+
+# Latency instrumentation: 'none', 'prometheus' or 'otel'. With several Prometheus
+# workers, also set PROMETHEUS_MULTIPROC_DIR to a directory they share
+METRICS_EXPORTER = os.getenv('METRICS_EXPORTER', 'none')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
\ No newline at end of file
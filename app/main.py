@@ -16,6 +16,8 @@
 
 import asyncio
 import logging
+import time
+import weakref
 from typing import Dict
 # These libraries are used for interacting with Google Cloud Dialogflow CX
 from google.cloud.dialogflowcx_v3beta1.services.agents import AgentsClient
@@ -43,6 +45,16 @@ import mimetypes
 import base64
 # These libraries are used for handling image and audio data
 from utils import *
+from utils_retry import (
+    RetryPolicy,
+    TokenBucket,
+    is_retryable,
+    PRIORITY_IMAGE,
+    PRIORITY_AUDIO,
+    PRIORITY_VIDEO,
+)
+from utils_stream import StreamingReply
+from utils_metrics import make_metrics
 from configs import *
 # Set the port for the webhook
 PORT = int(os.environ.get("PORT", 8080))
@@ -51,8 +63,165 @@ PORT = int(os.environ.get("PORT", 8080))
 vertexai.init(project=PROJECT_ID, location=LOCATION_ID)
 multimodal_model = GenerativeModel(MODEL)
 
-# Build Telegram application with webhook URL
-application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def post_init(application: Application):
+    """Creates the Dialogflow clients and HTTP session once at startup, inside the bot's event loop."""
+    sessions_client_pool.get(LOCATION_ID)
+    sessions_client_pool.get_async(LOCATION_ID)
+    await start_http_session(HTTP_POOL_SIZE, DNS_CACHE_TTL)
+
+async def post_shutdown(application: Application):
+    """Releases the shared HTTP session when the bot stops."""
+    await close_http_session()
+
+# Build Telegram application with webhook URL, processing updates concurrently
+application = (
+    Application.builder()
+    .token(TELEGRAM_TOKEN)
+    .concurrent_updates(CONCURRENT_UPDATES)
+    .post_init(post_init)
+    .post_shutdown(post_shutdown)
+    .build()
+)
+
+# Limit in-flight Dialogflow calls; per-chat locks keep each chat's replies in order
+detect_intent_semaphore = asyncio.Semaphore(DETECT_INTENT_CONCURRENCY)
+chat_locks = weakref.WeakValueDictionary()
+
+def get_chat_lock(chat_id: int) -> asyncio.Lock:
+    """Returns the lock serializing messages of one chat, creating it if needed."""
+    lock = chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        chat_locks[chat_id] = lock
+    return lock
+
+# Per-media-type limits on concurrent Gemini calls, so long video jobs cannot starve other traffic
+media_semaphores = {
+    "image": asyncio.Semaphore(IMAGE_CONCURRENCY),
+    "video": asyncio.Semaphore(VIDEO_CONCURRENCY),
+    "audio": asyncio.Semaphore(AUDIO_CONCURRENCY),
+}
+
+# Rate limiter and retry policy for the bot's Gemini calls, sized to its share of the quota;
+# images are served before audio and video within this process
+gemini_retry = RetryPolicy(
+    TokenBucket(rate=GEMINI_REQUESTS_PER_MINUTE / 60, capacity=GEMINI_BURST),
+    max_attempts=GEMINI_MAX_ATTEMPTS,
+)
+media_priorities = {
+    "image": PRIORITY_IMAGE,
+    "audio": PRIORITY_AUDIO,
+    "video": PRIORITY_VIDEO,
+}
+
+# Per-stage latency, token and byte histograms of the bot
+metrics = make_metrics(METRICS_EXPORTER, 'bot', METRICS_PORT)
+
+async def download_media(download_url: str) -> bytes:
+    """Downloads a Telegram file within MAX_DOWNLOAD_BYTES, timed as the media download stage."""
+    with metrics.span('media_download') as span:
+        data = await download_bytes(download_url, MAX_DOWNLOAD_BYTES)
+        span['bytes'] = len(data)
+    return data
+
+async def generate_media_response(media_type: str, contents: list):
+    """Generates a Gemini response without blocking the event loop.
+
+    Args:
+        media_type: One of 'image', 'video' or 'audio', selecting the concurrency limit
+                    and the priority in the shared rate limiter.
+        contents: The prompt parts sent to the model.
+
+    Returns:
+        The model response.
+    """
+    async with media_semaphores[media_type]:
+        with metrics.span('gemini_call') as span:
+            response = await gemini_retry.call_async(
+                multimodal_model.generate_content_async, contents,
+                priority=media_priorities[media_type],
+            )
+            span['tokens'] = response.usage_metadata.total_token_count
+        return response
+
+async def stream_media_response(media_type: str, contents: list, reply: StreamingReply):
+    """Generates a Gemini response into a Telegram reply, streaming it when enabled.
+
+    Args:
+        media_type: One of 'image', 'video' or 'audio', selecting the concurrency limit
+                    and the priority in the shared rate limiter.
+        contents: The prompt parts sent to the model.
+        reply: The reply that receives the generated text.
+    """
+    if not STREAM_RESPONSES:
+        response = await generate_media_response(media_type, contents)
+        await reply.append(response.text)
+        return
+
+    async with media_semaphores[media_type]:
+        # gemini_call excludes the Telegram edits made along the way, which are timed as
+        # telegram_send; gemini_first_chunk is the time until the first chunk arrives
+        start = time.perf_counter()
+        editing = 0.0
+        counts = {}
+        status = 'error'
+        try:
+            responses = await gemini_retry.call_async(
+                multimodal_model.generate_content_async, contents, stream=True,
+                priority=media_priorities[media_type],
+            )
+            async for chunk in responses:
+                if not counts:
+                    metrics.record('gemini_first_chunk', time.perf_counter() - start, 'ok', {})
+                counts['tokens'] = chunk.usage_metadata.total_token_count
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text, e.g. the final one carrying only metadata
+                    continue
+                edit_start = time.perf_counter()
+                await reply.append(text)
+                editing += time.perf_counter() - edit_start
+            status = 'ok'
+        finally:
+            metrics.record('gemini_call', time.perf_counter() - start - editing, status, counts)
+
+async def generate_for_batches(media_type: str, prompt_parts: list, batches: list,
+                               mime_type: str, reply: StreamingReply):
+    """Sends media inline in a single request, or chunked when it does not fit.
+
+    With more than one batch, each batch is described concurrently and a final
+    call merges the partial answers; only that final call is streamed.
+
+    Args:
+        media_type: One of 'image', 'video' or 'audio', selecting the concurrency limit.
+        prompt_parts: The text prompt parts sent with every request.
+        batches: Media items grouped by `batch_media`.
+        mime_type: MIME type of the media items.
+        reply: The reply that receives the generated text.
+    """
+    def to_parts(batch):
+        return [Part.from_data(mime_type=mime_type, data=item) for item in batch]
+
+    if len(batches) == 1:
+        await stream_media_response(media_type, prompt_parts + to_parts(batches[0]), reply)
+        return
+
+    logging.info(f"Sending {media_type} in {len(batches)} chunks")
+    partials = await asyncio.gather(*[
+        generate_media_response(media_type, [
+            f"This is part {index} of {len(batches)} of the user's {media_type}. "
+            "Describe everything relevant to the instruction."
+        ] + prompt_parts + to_parts(batch))
+        for index, batch in enumerate(batches, start=1)
+    ])
+    notes = [f"Notes for part {index}: {partial.text}" for index, partial in enumerate(partials, start=1)]
+    await stream_media_response(
+        media_type, prompt_parts + notes + ["Combine these notes into a single answer."], reply
+    )
+
+# Prepared images keyed by Telegram's file_unique_id
+image_cache = BytesLRUCache(IMAGE_CACHE_BYTES)
 
 # Define asynchronous handler functions for different message types
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -63,8 +232,15 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context:  The Telegram Context object.
     """
     telegram_request = update.to_dict()
-    response = detect_intent_response(telegram_request, PROJECT_ID, AGENT, LANGUAGE_CODE, LOCATION_ID)
-    await update.message.reply_text(response)
+    async with get_chat_lock(update.effective_chat.id):
+        async with detect_intent_semaphore:
+            with metrics.span('detect_intent'):
+                response = await detect_intent_response_async(
+                    telegram_request, PROJECT_ID, AGENT, LANGUAGE_CODE, LOCATION_ID
+                )
+        with metrics.span('telegram_send') as span:
+            span['bytes'] = len(response.encode('utf-8'))
+            await update.message.reply_text(response)
 
 async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles incoming image messages and generates a response using Gemini.
@@ -73,191 +249,185 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         update: The Telegram Update object containing the message.
         context:  The Telegram Context object.
     """
-    max_retries = 3
-    retry_delay = 2
 
     logging.info("Received image message")
 
-    for attempt in range(max_retries):
-        try:
-            logging.info(f"Processing image, attempt {attempt + 1}")
-            new_file = await context.bot.get_file(update.message.photo[-1].file_id)
-            download_url = new_file.file_path
-            instruction = update.message.caption
-
-            # Asynchronously download and load the image
-            downloaded_image = await load_image_from_url(download_url)
-
-            # Convert the image to bytes
-            image_bytes = io.BytesIO()
-            downloaded_image.save(image_bytes, format=downloaded_image.format)
-            image_bytes = image_bytes.getvalue()
+    try:
+        logging.info("Processing image")
+        instruction = update.message.caption
 
-            prompt = "Using the following image, respond to the user's instruction."
-            prompt2 = f"Instruction: {instruction}"
+        # Use the smallest Telegram size that meets the target resolution
+        photo = select_photo_size(update.message.photo, IMAGE_TARGET_SIDE)
+        image_bytes = image_cache.get(photo.file_unique_id)
 
-            # Get the file extension
-            extension = download_url.split('.')[-1]
-
-            # Use mimetypes to guess the MIME type
-            mime_type = mimetypes.guess_type(f"image.{extension}")[0]
+        if image_bytes is None:
+            new_file = await context.bot.get_file(photo.file_id)
+            download_url = new_file.file_path
 
-            # Create a Part object for the image
-            image_part = Part.from_data(
-                mime_type=mime_type,
-                data=image_bytes,
+            # Asynchronously download the image; it is only decoded if it needs downscaling
+            image_bytes = await download_media(download_url)
+            if max(photo.width, photo.height) > IMAGE_TARGET_SIDE:
+                image_bytes = await asyncio.to_thread(
+                    prepare_image, image_bytes, IMAGE_TARGET_SIDE, IMAGE_JPEG_QUALITY
+                )
+            image_cache.set(photo.file_unique_id, image_bytes)
+
+        prompt = "Using the following image, respond to the user's instruction."
+        prompt2 = f"Instruction: {instruction}"
+
+        # Create a Part object for the image (Telegram photos are always JPEG)
+        image_part = Part.from_data(
+            mime_type="image/jpeg",
+            data=image_bytes,
+        )
+
+        contents = [
+            prompt,
+            image_part,
+            prompt2
+        ]
+
+        # Long responses continue in follow-up messages instead of being truncated
+        reply = StreamingReply(update.message, MAX_RESPONSE_LENGTH, STREAM_EDIT_INTERVAL, metrics)
+        await stream_media_response("image", contents, reply)
+        await reply.finish()
+
+    except MediaTooLargeError as e:
+        logging.warning(f"Rejected image: {e}")
+        await update.message.reply_text("Sorry, that file is too large for me to process.")
+
+    except Exception as e:
+        if is_retryable(e):
+            logging.error(f"Gemini still throttled after retries: {e}")
+            await update.message.reply_text(
+                "Sorry, the service is temporarily unavailable. Please try again later."
             )
-
-            contents = [
-                prompt,
-                image_part,
-                prompt2
-            ]
-
-            response = multimodal_model.generate_content(contents)
-            print(type(MAX_RESPONSE_LENGTH))
-            # Truncate the response if it exceeds the maximum length
-            if int(len(response.text)) > MAX_RESPONSE_LENGTH:
-                response.text = response.text[:MAX_RESPONSE_LENGTH] + "...(description truncated)"
-            await update.message.reply_text(response.text)
-            return # Success, exit the loop
-
-        except Exception as e:
-            if "429" in str(e):  # Check for the specific error code
-                logging.warning(f"Gemini 429 error, retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-            else:
-                logging.error(f"Error processing image: {e}")
-                await update.message.reply_text("Sorry, there was an error processing your image.")
-                return  # Unhandled error, exit the loop
+        else:
+            logging.error(f"Error processing image: {e}")
+            await update.message.reply_text("Sorry, there was an error processing your image.")
 
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles incoming video messages, prepares them for Gemini, and generates a response.
 
-    This handler downloads the video sent by the user, encodes it to base64, 
-    and sends it to the Gemini model along with a prompt based on the user's 
+    This handler downloads the video sent by the user and sends its raw bytes
+    to the Gemini model along with a prompt based on the user's 
     caption (if provided). If successful, it sends the model's response back 
-    to the user. The function includes retry logic for handling potential 
-    rate limit errors (HTTP 429) from the Gemini API.
+    to the user. Gemini calls are rate limited and retried with backoff on
+    rate limit errors (HTTP 429) by the shared resilience layer.
 
     Args:
         update (Update): The Telegram Update object containing the message.
         context (ContextTypes.DEFAULT_TYPE): The Telegram Context object.
     """
-    max_retries = 3
-    retry_delay = 2
 
     logging.info("Received video message")
 
-    for attempt in range(max_retries):
-        try:
-            logging.info(f"Processing video, attempt {attempt + 1}")
-            new_file = await context.bot.get_file(update.message.video.file_id)
-            download_url = new_file.file_path
-            instruction = update.message.caption
-            extension = new_file.file_path.split('.')[-1]
-
-            logging.info(f"Recieve")
-            # Download and convert video data (consider optimizing this part)
-            async with aiohttp.ClientSession() as session:
-                async with session.get(download_url) as resp:
-                    video_data = await resp.read()
-
-            logging.info(f"Encoding video data")        
-            video_bytes = base64.b64encode(video_data).decode('utf-8') 
-
-            prompt = "Using the following video, respond to the user's instruction."
-            prompt2 = f"Instruction: {instruction}"
-            
-            logging.info(f"Prompting Gemini with {prompt} {prompt2}")
-
-            video = Part.from_data(
-                mime_type=f"video/{extension}",
-                data=video_bytes,
+    try:
+        logging.info("Processing video")
+        media = update.message.video or update.message.video_note
+        new_file = await context.bot.get_file(media.file_id)
+        download_url = new_file.file_path
+        instruction = update.message.caption
+        extension = new_file.file_path.split('.')[-1]
+
+        # Download the video; Part.from_data takes the raw bytes, no base64 copy needed
+        video_bytes = await download_media(download_url)
+
+        prompt = "Using the following video, respond to the user's instruction."
+        prompt2 = f"Instruction: {instruction}"
+
+        if len(video_bytes) <= MEDIA_INLINE_MAX_BYTES:
+            batches, mime_type = [[video_bytes]], f"video/{extension}"
+        else:
+            # Too large to send inline: reduce it to keyframes within the frame budget
+            frames = await asyncio.to_thread(
+                sample_video_frames, video_bytes, extension, VIDEO_SAMPLE_FPS,
+                VIDEO_MAX_FRAMES, IMAGE_TARGET_SIDE, IMAGE_JPEG_QUALITY
             )
-
-            contents = [prompt, prompt2, video]
-
-            response = multimodal_model.generate_content(contents)
-            if len(response.text) > MAX_RESPONSE_LENGTH:
-                response.text = response.text[:MAX_RESPONSE_LENGTH] + "...(description truncated)"
-            await update.message.reply_text(response.text)
-            return  # Success, exit the loop
-
-        except Exception as e:
-            if "429" in str(e):  # Check for the specific error code
-                logging.warning(f"Gemini 429 error, retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-            else:
-                logging.error(f"Error processing video: {e}")
-                await update.message.reply_text("Sorry, there was an error processing your video.")
-                return  # Unhandled error, exit the loop
-
-    # If the loop completes without success, inform the user
-    logging.error(f"Failed to process video after {max_retries} attempts.")
-    await update.message.reply_text(
-        "Sorry, the service is temporarily unavailable. Please try again later."
-    )
+            logging.info(f"Reduced {len(video_bytes)} byte video to {len(frames)} frames")
+            prompt = "Using the following frames sampled in order from a video, respond to the user's instruction."
+            batches, mime_type = batch_media(frames, MEDIA_INLINE_MAX_BYTES), "image/jpeg"
+        
+        logging.debug(f"Prompting Gemini with {prompt} {prompt2}")
+
+        reply = StreamingReply(update.message, MAX_RESPONSE_LENGTH, STREAM_EDIT_INTERVAL, metrics)
+        await generate_for_batches("video", [prompt, prompt2], batches, mime_type, reply)
+        await reply.finish()
+
+    except MediaTooLargeError as e:
+        logging.warning(f"Rejected video: {e}")
+        await update.message.reply_text("Sorry, that file is too large for me to process.")
+
+    except VideoDecodeError as e:
+        logging.warning(f"Rejected video: {e}")
+        await update.message.reply_text("Sorry, I couldn't read any frames from that video.")
+
+    except Exception as e:
+        if is_retryable(e):
+            logging.error(f"Gemini still throttled after retries: {e}")
+            await update.message.reply_text(
+                "Sorry, the service is temporarily unavailable. Please try again later."
+            )
+        else:
+            logging.error(f"Error processing video: {e}")
+            await update.message.reply_text("Sorry, there was an error processing your video.")
 
 
 async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles incoming audio messages, prepares them for Gemini, and generates a response.
 
-    This handler downloads the audio sent by the user, encodes it to base64,
-    and sends it to the Gemini model along with a prompt. If successful, it sends 
-    the model's response back to the user. The function includes retry logic for 
-    handling potential rate limit errors (HTTP 429) from the Gemini API.
+    This handler downloads the audio sent by the user and sends its raw bytes
+    to the Gemini model along with a prompt. If successful, it sends 
+    the model's response back to the user. Gemini calls are rate limited and
+    retried with backoff on rate limit errors (HTTP 429) by the shared resilience layer.
 
     Args:
         update (Update): The Telegram Update object containing the message.
         context (ContextTypes.DEFAULT_TYPE): The Telegram Context object.
     """
 
-    max_retries = 3
-    retry_delay = 2
-    
     logging.info("Received audio message")
 
-    for attempt in range(max_retries):
-        try:        
-            logging.info(f"Processing audio, attempt {attempt + 1}")
-            # Get the MIME type from the message
-            mime_type = update.message.voice.mime_type  
-
-            new_file = await context.bot.get_file(update.message.voice.file_id)
-            download_url = new_file.file_path
-            instruction = update.message.caption
+    try:
+        logging.info("Processing audio")
+        # Get the MIME type from the message
+        mime_type = update.message.voice.mime_type  
 
-            # Asynchronously download the audio data
-            async with aiohttp.ClientSession() as session:
-                async with session.get(download_url) as resp:
-                    audio_data = await resp.read()
+        new_file = await context.bot.get_file(update.message.voice.file_id)
+        download_url = new_file.file_path
+        instruction = update.message.caption
 
-            # Encode audio data as base64
-            audio_bytes = base64.b64encode(audio_data).decode('utf-8')
+        # Asynchronously download the audio data
+        audio_bytes = await download_media(download_url)
 
-            prompt = "Responde al audio del usuario"
+        prompt = "Responde al audio del usuario"
 
-            # Create a Part object for the audio
-            audio_part = Part.from_data(
-                mime_type=mime_type,  # Use the extracted MIME type
-                data=audio_bytes,
+        if len(audio_bytes) > AUDIO_TRANSCODE_MIN_BYTES:
+            # Downmix and resample long audio, split into inline-sized segments
+            segments = await asyncio.to_thread(
+                transcode_audio, audio_bytes, AUDIO_SAMPLE_RATE, MEDIA_INLINE_MAX_BYTES
             )
-
-            contents = [prompt, audio_part]
-
-            response = multimodal_model.generate_content(contents)
-            await update.message.reply_text(response.text)
-            return  # Success, exit the loop
-
-        except Exception as e:
-            if "429" in str(e):  # Check for the specific error code
-                logging.warning(f"Gemini 429 error, retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-            else:
-                logging.error(f"Error processing Audio: {e}")
-                await update.message.reply_text("Sorry, there was an error processing your Audio.")
-                return  # Unhandled error, exit the loop
+            batches, mime_type = batch_media(segments, MEDIA_INLINE_MAX_BYTES), "audio/ogg"
+        else:
+            batches = [[audio_bytes]]
+
+        reply = StreamingReply(update.message, MAX_RESPONSE_LENGTH, STREAM_EDIT_INTERVAL, metrics)
+        await generate_for_batches("audio", [prompt], batches, mime_type, reply)
+        await reply.finish()
+
+    except MediaTooLargeError as e:
+        logging.warning(f"Rejected audio: {e}")
+        await update.message.reply_text("Sorry, that file is too large for me to process.")
+
+    except Exception as e:
+        if is_retryable(e):
+            logging.error(f"Gemini still throttled after retries: {e}")
+            await update.message.reply_text(
+                "Sorry, the service is temporarily unavailable. Please try again later."
+            )
+        else:
+            logging.error(f"Error processing Audio: {e}")
+            await update.message.reply_text("Sorry, there was an error processing your Audio.")
 
 def main():
     # Configure logging
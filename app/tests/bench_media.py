@@ -0,0 +1,146 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares peak memory of the legacy and current media ingestion paths.
+
+Both paths go from the downloaded bytes to the `Part` sent to Gemini: the
+legacy ones decode and re-save images with PIL and base64-encode videos,
+the current ones pass the downloaded bytes to `Part.from_data` as they are.
+
+Run from the repository root:
+
+    python app/tests/bench_media.py
+
+Each path runs in a fresh process; the growth of that process's peak RSS
+while the path runs is reported per MB of media.
+
+It also reports, per clip length, the bytes sent to Gemini before and after
+the video keyframe sampling and audio transcoding stage, with the local
+processing latency it adds.
+"""
+
+import sys
+sys.path.append('app/')
+import base64
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import soundfile as sf
+from PIL import Image
+from vertexai.generative_models import Part
+
+def make_image(side: int) -> bytes:
+    """Builds a noisy JPEG so the encoded size is realistic."""
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+def legacy_image(data: bytes):
+    # load_image_from_url + re-save into a new BytesIO, as handle_image used to do
+    image = Image.open(io.BytesIO(data))
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format=image.format)
+    return Part.from_data(mime_type="image/jpeg", data=image_bytes.getvalue())
+
+def legacy_video(data: bytes):
+    # resp.read() result base64-encoded into a str before Part.from_data, as handle_video used to do
+    return Part.from_data(mime_type="video/mp4", data=base64.b64encode(data).decode('utf-8'))
+
+def current_image(data: bytes):
+    # Downloaded bytes passed as they are, as handle_image does now
+    return Part.from_data(mime_type="image/jpeg", data=data)
+
+def current_video(data: bytes):
+    return Part.from_data(mime_type="video/mp4", data=data)
+
+def _measure(func, data: bytes, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = func(data)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del result
+    queue.put((after - before) * 1024)  # ru_maxrss is in KB on Linux
+
+def peak_mb_per_media_mb(func, data: bytes) -> float:
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(func, data, queue))
+    process.start()
+    peak_growth = queue.get()
+    process.join()
+    return peak_growth / len(data)
+
+def make_video(seconds: int, fps: int = 30, size=(640, 360)) -> bytes:
+    """Builds an MP4 clip of moving noise."""
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as video_file:
+        writer = cv2.VideoWriter(video_file.name, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        base = np.random.randint(0, 255, (size[1], size[0] * 2, 3), dtype=np.uint8)
+        for index in range(seconds * fps):
+            offset = (index * 4) % size[0]
+            writer.write(np.ascontiguousarray(base[:, offset:offset + size[0]]))
+        writer.release()
+        with open(video_file.name, "rb") as f:
+            return f.read()
+
+def make_audio(seconds: int, rate: int = 44100) -> bytes:
+    """Builds a stereo Ogg Vorbis clip of a tone with noise."""
+    times = np.arange(seconds * rate) / rate
+    tone = 0.3 * np.sin(2 * np.pi * 440 * times) + 0.05 * np.random.randn(len(times))
+    samples = np.stack([tone, tone], axis=1).astype(np.float32)
+    output = io.BytesIO()
+    with sf.SoundFile(output, "w", rate, 2, format="OGG", subtype="VORBIS") as audio_file:
+        for start in range(0, len(samples), rate * 10):
+            audio_file.write(samples[start:start + rate * 10])
+    return output.getvalue()
+
+def bench_reduction():
+    from utils import sample_video_frames, transcode_audio
+
+    print(f"\n{'clip':<12}{'raw KB':>12}{'sent KB':>12}{'local ms':>12}")
+    for seconds in (10, 30, 60):
+        data = make_video(seconds)
+        start = time.perf_counter()
+        frames = sample_video_frames(data, "mp4", fps=1.0, max_frames=60, target_side=1024, quality=85)
+        elapsed = (time.perf_counter() - start) * 1000
+        sent = sum(len(frame) for frame in frames)
+        print(f"{f'video {seconds}s':<12}{len(data) / 1024:>12.0f}{sent / 1024:>12.0f}{elapsed:>12.0f}")
+    for seconds in (30, 120, 300):
+        data = make_audio(seconds)
+        start = time.perf_counter()
+        segments = transcode_audio(data, 16000)
+        elapsed = (time.perf_counter() - start) * 1000
+        sent = sum(len(segment) for segment in segments)
+        print(f"{f'audio {seconds}s':<12}{len(data) / 1024:>12.0f}{sent / 1024:>12.0f}{elapsed:>12.0f}")
+
+def main():
+    cases = [
+        ("image", make_image(2048), legacy_image, current_image),
+        ("video", os.urandom(20 * 1024 * 1024), legacy_video, current_video),
+    ]
+    print(f"{'media':<8}{'size MB':>10}{'legacy':>12}{'current':>12}  (peak RSS MB per media MB)")
+    for name, data, legacy, current in cases:
+        before = peak_mb_per_media_mb(legacy, data)
+        after = peak_mb_per_media_mb(current, data)
+        print(f"{name:<8}{len(data) / 2**20:>10.2f}{before:>12.2f}{after:>12.2f}")
+    bench_reduction()
+
+if __name__ == '__main__':
+    main()
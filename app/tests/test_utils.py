@@ -0,0 +1,55 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('app/')
+from types import SimpleNamespace
+from utils import BytesLRUCache, select_photo_size, batch_media
+
+def test_bytes_lru_cache_evicts_least_recently_used_by_size():
+    cache = BytesLRUCache(max_bytes=10)
+    cache.set('a', b'x' * 4)
+    cache.set('b', b'x' * 4)
+    assert cache.get('a') == b'x' * 4
+    cache.set('c', b'x' * 4)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+def test_bytes_lru_cache_skips_values_over_the_cap():
+    cache = BytesLRUCache(max_bytes=10)
+    cache.set('a', b'x' * 4)
+    cache.set('big', b'x' * 11)
+    assert cache.get('big') is None
+    assert cache.get('a') == b'x' * 4
+
+def test_bytes_lru_cache_replaces_values():
+    cache = BytesLRUCache(max_bytes=10)
+    cache.set('a', b'x' * 6)
+    cache.set('a', b'y' * 6)
+    cache.set('b', b'x' * 4)
+    assert cache.get('a') == b'y' * 6
+    assert cache.get('b') == b'x' * 4
+
+def test_select_photo_size_picks_smallest_size_meeting_target():
+    photos = [SimpleNamespace(width=90, height=60), SimpleNamespace(width=800, height=1280),
+              SimpleNamespace(width=1600, height=2560)]
+    assert select_photo_size(photos, 1024) is photos[1]
+    assert select_photo_size(photos, 4096) is photos[2]
+
+def test_batch_media_groups_items_within_the_byte_cap():
+    items = [b'a' * 4, b'b' * 4, b'c' * 4, b'd' * 12]
+    assert batch_media(items, 10) == [[b'a' * 4, b'b' * 4], [b'c' * 4], [b'd' * 12]]
+    assert batch_media(items[:2], 10) == [items[:2]]
@@ -0,0 +1,97 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('app/')
+import asyncio
+from telegram.error import BadRequest, RetryAfter
+from utils_stream import split_text, StreamingReply
+
+class FakeMessage:
+    def __init__(self, text=None):
+        self.text = text
+        self.replies = []
+        self.edits = []
+        self.errors = []
+
+    async def reply_text(self, text):
+        reply = FakeMessage(text)
+        self.replies.append(reply)
+        return reply
+
+    async def edit_text(self, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.edits.append(text)
+        self.text = text
+
+def test_split_text_prefers_line_and_word_breaks():
+    assert split_text("first line\nsecond line", 15) == ["first line", "second line"]
+    assert split_text("one two three", 8) == ["one two", "three"]
+    assert split_text("abcdefghij", 4) == ["abcd", "efgh", "ij"]
+    assert split_text("short", 10) == ["short"]
+
+def test_streaming_reply_throttles_edits():
+    async def scenario():
+        message = FakeMessage()
+        reply = StreamingReply(message, max_length=100, edit_interval=60)
+        await reply.append("Hello")
+        await reply.append(" world")
+        await reply.append("!")
+        sent = message.replies[0]
+        assert (sent.text, sent.edits) == ("Hello", [])
+        await reply.finish()
+        return message
+    message = asyncio.run(scenario())
+    assert len(message.replies) == 1
+    assert message.replies[0].edits == ["Hello world!"]
+
+def test_streaming_reply_pauses_edits_after_retry_after():
+    async def scenario():
+        message = FakeMessage()
+        reply = StreamingReply(message, max_length=100, edit_interval=0)
+        await reply.append("a")
+        sent = message.replies[0]
+        sent.errors.append(RetryAfter(30))
+        await reply.append("b")
+        await reply.append("c")
+        assert sent.edits == []
+        sent.errors.append(RetryAfter(0))
+        await reply.finish()
+        return sent
+    assert asyncio.run(scenario()).edits == ["abc"]
+
+def test_streaming_reply_continues_in_new_messages():
+    async def scenario():
+        message = FakeMessage()
+        reply = StreamingReply(message, max_length=10, edit_interval=0)
+        await reply.append("one two ")
+        await reply.append("three four five")
+        await reply.finish()
+        return message
+    message = asyncio.run(scenario())
+    assert [sent.text for sent in message.replies] == ["one two", "three four", "five"]
+
+def test_streaming_reply_ignores_unmodified_edits():
+    async def scenario():
+        message = FakeMessage()
+        reply = StreamingReply(message, max_length=100, edit_interval=0)
+        await reply.append("Hello")
+        message.replies[0].errors.append(BadRequest("Message is not modified"))
+        await reply.append(" again")
+        await reply.finish()
+        return message.replies[0]
+    assert asyncio.run(scenario()).edits == ["Hello again"]
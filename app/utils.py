@@ -24,7 +24,11 @@ import aiohttp
 import logging
 from typing import Dict
 from google.cloud.dialogflowcx_v3beta1.services.agents import AgentsClient
-from google.cloud.dialogflowcx_v3beta1.services.sessions import SessionsClient
+from google.cloud.dialogflowcx_v3beta1.services.sessions import SessionsClient, SessionsAsyncClient
+from google.cloud.dialogflowcx_v3beta1.services.sessions.transports import (
+    SessionsGrpcTransport,
+    SessionsGrpcAsyncIOTransport,
+)
 from google.cloud.dialogflowcx_v3beta1.types import session, audio_config
 
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
@@ -47,12 +51,93 @@ from vertexai.generative_models import (
 )
 
 from PIL import Image 
+import cv2
+import numpy as np
 
 import http.client
+import tempfile
+from collections import OrderedDict
+import threading
+import time
 import typing
 import urllib.request
 import base64
 
+# Keepalive settings for the long-lived Dialogflow gRPC channels
+GRPC_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+
+class SessionsClientPool:
+    """Long-lived Dialogflow Sessions clients keyed by location.
+
+    Each location gets one sync and one asyncio client, each with its own
+    keepalive gRPC channel, so TLS and auth setup happen once per worker
+    instead of once per message. Call latencies are recorded per location.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._async_clients = {}
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    @staticmethod
+    def endpoint(location_id: str) -> str:
+        if location_id == "global":
+            return "dialogflow.googleapis.com:443"
+        return f"{location_id}-dialogflow.googleapis.com:443"
+
+    def get(self, location_id: str) -> SessionsClient:
+        """Returns the sync client for a location, creating it on first use."""
+        with self._lock:
+            client = self._clients.get(location_id)
+            if client is None:
+                endpoint = self.endpoint(location_id)
+                channel = SessionsGrpcTransport.create_channel(endpoint, options=GRPC_CHANNEL_OPTIONS)
+                client = SessionsClient(transport=SessionsGrpcTransport(host=endpoint, channel=channel))
+                self._clients[location_id] = client
+                logging.info(f"Created Dialogflow Sessions client for {endpoint}")
+            return client
+
+    def get_async(self, location_id: str) -> SessionsAsyncClient:
+        """Returns the asyncio client for a location, creating it on first use.
+
+        Must be called from the event loop that will use the client.
+        """
+        client = self._async_clients.get(location_id)
+        if client is None:
+            endpoint = self.endpoint(location_id)
+            channel = SessionsGrpcAsyncIOTransport.create_channel(endpoint, options=GRPC_CHANNEL_OPTIONS)
+            client = SessionsAsyncClient(transport=SessionsGrpcAsyncIOTransport(host=endpoint, channel=channel))
+            self._async_clients[location_id] = client
+            logging.info(f"Created Dialogflow Sessions async client for {endpoint}")
+        return client
+
+    def record(self, location_id: str, seconds: float):
+        """Records the latency of one detect_intent call."""
+        with self._lock:
+            metrics = self._metrics.setdefault(
+                location_id, {"calls": 0, "first_call_ms": seconds * 1000, "total_ms": 0.0}
+            )
+            metrics["calls"] += 1
+            metrics["total_ms"] += seconds * 1000
+        logging.info(
+            f"detect_intent {location_id}: {seconds * 1000:.1f} ms "
+            f"(call {metrics['calls']}, first call {metrics['first_call_ms']:.1f} ms, "
+            f"mean {metrics['total_ms'] / metrics['calls']:.1f} ms)"
+        )
+
+    def stats(self) -> Dict:
+        """Returns per-location call counts and latencies."""
+        with self._lock:
+            return {location: dict(metrics) for location, metrics in self._metrics.items()}
+
+sessions_client_pool = SessionsClientPool()
+
 def get_image_bytes_from_url(image_url: str) -> bytes:
     """Downloads image data from a URL and returns it as bytes.
 
@@ -67,14 +152,263 @@ def get_image_bytes_from_url(image_url: str) -> bytes:
         image_bytes = response.read()
     return image_bytes
 
-async def load_image_from_url(url):
+class MediaTooLargeError(Exception):
+    """Raised when a media download exceeds the configured size cap."""
+
+# Application-wide HTTP session, shared by all media downloads
+_http_session = None
+
+async def start_http_session(pool_size: int = 100, dns_cache_ttl: int = 300):
+    """Creates the shared, connection-pooled HTTP session with DNS caching.
+
+    Args:
+        pool_size: Maximum number of simultaneous connections.
+        dns_cache_ttl: Seconds DNS lookups are cached.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=pool_size, ttl_dns_cache=dns_cache_ttl)
+        _http_session = aiohttp.ClientSession(connector=connector)
+
+async def close_http_session():
+    """Closes the shared HTTP session."""
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
+async def download_bytes(url: str, max_bytes: int = None, chunk_size: int = 64 * 1024) -> bytes:
+    """Streams a download through the shared HTTP session, enforcing a size cap.
+
+    Args:
+        url: The URL to download.
+        max_bytes: Maximum accepted size in bytes, or None for no limit.
+        chunk_size: Size of the chunks read from the connection.
+
+    Returns:
+        bytes: The downloaded data.
+
+    Raises:
+        MediaTooLargeError: If the download is larger than `max_bytes`.
+    """
+    if _http_session is None or _http_session.closed:
+        await start_http_session()
+    async with _http_session.get(url) as resp:
+        resp.raise_for_status()
+        if max_bytes is not None and (resp.content_length or 0) > max_bytes:
+            raise MediaTooLargeError(f"Media is {resp.content_length} bytes, limit is {max_bytes}")
+        chunks = []
+        size = 0
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise MediaTooLargeError(f"Media exceeds the {max_bytes} bytes limit")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+async def load_image_from_url(url, max_bytes: int = None):
     """Asynchronously loads an image from a URL."""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            image_data = await resp.read()
+    image_data = await download_bytes(url, max_bytes)
     image = Image.open(io.BytesIO(image_data))
     return image
 
+def select_photo_size(photos: list, target_side: int):
+    """Picks the smallest Telegram photo size that still meets the target resolution.
+
+    Args:
+        photos: The `PhotoSize` list of a message, ordered from smallest to largest.
+        target_side: Desired length in pixels of the longest side.
+
+    Returns:
+        PhotoSize: The smallest size whose longest side is at least `target_side`,
+                   or the largest available size.
+    """
+    for photo in photos:
+        if max(photo.width, photo.height) >= target_side:
+            return photo
+    return photos[-1]
+
+def prepare_image(image_data: bytes, target_side: int, quality: int) -> bytes:
+    """Downscales an image to fit `target_side` and re-encodes it as JPEG.
+
+    Images that already fit are returned untouched, without being decoded.
+
+    Args:
+        image_data: The encoded image.
+        target_side: Maximum length in pixels of the longest side.
+        quality: JPEG quality used when the image is re-encoded.
+
+    Returns:
+        bytes: The JPEG encoded image.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    if max(image.size) <= target_side and image.format == "JPEG":
+        return image_data
+    image.thumbnail((target_side, target_side), Image.LANCZOS)
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+class BytesLRUCache:
+    """In-memory LRU cache of byte strings bounded by their total size.
+
+    Args:
+        max_bytes: Maximum combined size of the cached values.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._data:
+            self._size -= len(self._data.pop(key))
+        self._data[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self._size -= len(evicted)
+
+class VideoDecodeError(Exception):
+    """Raised when no frames can be decoded from a video."""
+
+def sample_video_frames(video_data: bytes, extension: str, fps: float,
+                        max_frames: int, target_side: int, quality: int) -> list:
+    """Samples JPEG keyframes from a video at a fixed rate within a frame budget.
+
+    Skipped frames are only grabbed, not decoded, so the cost is dominated by
+    the frames that are kept. When the container does not report its frame
+    count, frames are read until the decoder stops, and the kept frames are
+    thinned out whenever they exceed the budget.
+
+    Args:
+        video_data: The encoded video.
+        extension: File extension of the video, used by the decoder.
+        fps: Frames sampled per second of video.
+        max_frames: Maximum number of frames returned, spread over the whole clip.
+        target_side: Maximum length in pixels of the longest side of each frame.
+        quality: JPEG quality of the frames.
+
+    Returns:
+        list: The sampled frames as JPEG bytes, in order.
+
+    Raises:
+        VideoDecodeError: If no frame could be decoded.
+    """
+    with tempfile.NamedTemporaryFile(suffix=f".{extension}") as video_file:
+        video_file.write(video_data)
+        video_file.flush()
+        capture = cv2.VideoCapture(video_file.name)
+        try:
+            source_fps = capture.get(cv2.CAP_PROP_FPS) or 25
+            frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            frames = []
+            if frame_count > 0:
+                duration = frame_count / source_fps
+                wanted = min(max_frames, max(1, int(duration * fps)))
+                indexes = set(np.linspace(0, frame_count - 1, wanted).astype(int).tolist())
+                for index in range(frame_count):
+                    if not capture.grab():
+                        break
+                    if index in indexes:
+                        frames.extend(encode_frame(capture, target_side, quality))
+            else:
+                step = max(1, round(source_fps / fps))
+                index = 0
+                while capture.grab():
+                    if index % step == 0:
+                        frames.extend(encode_frame(capture, target_side, quality))
+                        if len(frames) > max_frames:
+                            # Keep every other frame and sample at half the rate from now on
+                            frames = frames[::2]
+                            step *= 2
+                    index += 1
+        finally:
+            capture.release()
+    if not frames:
+        raise VideoDecodeError("No frames could be decoded from the video.")
+    return frames
+
+def encode_frame(capture, target_side: int, quality: int) -> list:
+    """Decodes the last grabbed frame, downscales it and encodes it as JPEG.
+
+    Returns:
+        list: The JPEG bytes, or an empty list if the frame could not be decoded.
+    """
+    ok, frame = capture.retrieve()
+    if not ok:
+        return []
+    height, width = frame.shape[:2]
+    scale = target_side / max(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, (int(width * scale), int(height * scale)),
+                           interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return [encoded.tobytes()] if ok else []
+
+def transcode_audio(audio_data: bytes, sample_rate: int, max_bytes: int = None) -> list:
+    """Downmixes audio to mono, resamples it and re-encodes it as Ogg Opus.
+
+    Args:
+        audio_data: The encoded audio, in any format soundfile can read (e.g. OGG voice notes).
+        sample_rate: Output sample rate in Hz (8000, 12000, 16000, 24000 or 48000).
+        max_bytes: If set, the audio is split into consecutive segments of
+                   roughly this size, each encoded separately.
+
+    Returns:
+        list: The encoded audio segments, in order.
+    """
+    samples, source_rate = sf.read(io.BytesIO(audio_data), dtype="float32", always_2d=True)
+    mono = samples.mean(axis=1)
+    if source_rate != sample_rate:
+        duration = len(mono) / source_rate
+        target_times = np.arange(int(duration * sample_rate)) / sample_rate
+        source_times = np.arange(len(mono)) / source_rate
+        mono = np.interp(target_times, source_times, mono).astype(np.float32)
+
+    def encode(segment):
+        output = io.BytesIO()
+        # Written in blocks: libsndfile's Ogg encoder can crash on very large single writes
+        with sf.SoundFile(output, "w", sample_rate, 1, format="OGG", subtype="OPUS") as audio_file:
+            for start in range(0, len(segment), sample_rate * 10):
+                audio_file.write(segment[start:start + sample_rate * 10])
+        return output.getvalue()
+
+    encoded = encode(mono)
+    if max_bytes is None or len(encoded) <= max_bytes:
+        return [encoded]
+    segment_count = -(-len(encoded) // max_bytes)
+    return [encode(segment) for segment in np.array_split(mono, segment_count)]
+
+def batch_media(items: list, max_bytes: int) -> list:
+    """Groups consecutive media items into batches of at most `max_bytes`.
+
+    Args:
+        items: Encoded media items, e.g. frames or audio segments.
+        max_bytes: Maximum combined size of a batch sent inline in one request.
+
+    Returns:
+        list: Lists of items; a single batch means everything fits in one request.
+    """
+    batches = [[]]
+    size = 0
+    for item in items:
+        if batches[-1] and size + len(item) > max_bytes:
+            batches.append([])
+            size = 0
+        batches[-1].append(item)
+        size += len(item)
+    return batches
+
 def download_video(url, filename):
     """Downloads the video from the provided URL and saves it locally.
 
@@ -91,10 +425,10 @@ def download_video(url, filename):
             for chunk in response.iter_content(1024):
                 file.write(chunk)
 
-        print(f"Video downloaded successfully as '{filename}'")
+        logging.info(f"Video downloaded successfully as '{filename}'")
 
     except requests.exceptions.RequestException as error:
-        print(f"Video download failed: {error}")
+        logging.error(f"Video download failed: {error}")
 
 def video_to_base64(video_path: str) -> str:
     """Encodes a video file into a base64 string.
@@ -129,13 +463,7 @@ def detect_intent_audio(telegram_request: dict, agent: str,
 
     session_id = telegram_request['message']['chat']['id']
     session_path = f"{agent}/sessions/{session_id}"
-    client_options = None
-    agent_components = AgentsClient.parse_agent_path(agent)
-    if location_id != "global":
-        api_endpoint = f"{location_id}-dialogflow.googleapis.com:443"
-        print(f"API Endpoint: {api_endpoint}\n")
-        client_options = {"api_endpoint": api_endpoint}
-    session_client = SessionsClient(client_options=client_options)
+    session_client = sessions_client_pool.get(location_id)
 
     input_audio_config = audio_config.InputAudioConfig(
         audio_encoding=audio_config.AudioEncoding.AUDIO_ENCODING_LINEAR_16,
@@ -144,18 +472,20 @@ def detect_intent_audio(telegram_request: dict, agent: str,
 
     with open(audio_file_path, "rb") as audio_file:
         input_audio = audio_file.read()
-        print("the audio was read successfully")
+        logging.debug("the audio was read successfully")
 
     audio_input = session.AudioInput(config=input_audio_config, audio=input_audio)
     query_input = session.QueryInput(audio=audio_input, language_code=language_code)
     request = session.DetectIntentRequest(session=session_path, query_input=query_input)
     
+    start = time.perf_counter()
     response = session_client.detect_intent(request=request)
+    sessions_client_pool.record(location_id, time.perf_counter() - start)
     response_messages = [
         " ".join(msg.text.text) for msg in response.query_result.response_messages
     ]
 
-    print(f"Response text: {' '.join(response_messages)}\n")
+    logging.debug(f"Response text: {' '.join(response_messages)}")
 
     return ' '.join(response_messages)
 
@@ -178,13 +508,7 @@ def detect_intent_response(telegram_request: dict,
     session_id = telegram_request['message']['chat']['id']
     session_path = f"{agent}/sessions/{session_id}"
     texts = [telegram_request['message']['text']]
-    client_options = None
-    agent_components = AgentsClient.parse_agent_path(agent)
-    if location_id != "global":
-        api_endpoint = f"{location_id}-dialogflow.googleapis.com:443"
-        print(f"API Endpoint: {api_endpoint}\n")
-        client_options = {"api_endpoint": api_endpoint}
-    session_client = SessionsClient(client_options=client_options)
+    session_client = sessions_client_pool.get(location_id)
     
     for text in texts:  
         text_input = session.TextInput(text=text)
@@ -192,10 +516,50 @@ def detect_intent_response(telegram_request: dict,
         request = session.DetectIntentRequest(
             session=session_path, query_input=query_input
         )
+        start = time.perf_counter()
         response = session_client.detect_intent(request=request)
+        sessions_client_pool.record(location_id, time.perf_counter() - start)
         
         response_messages = [
             " ".join(msg.text.text) for msg in response.query_result.response_messages
         ]
     
-    return ' '.join(response_messages)
\ No newline at end of file
+    return ' '.join(response_messages)
+
+async def detect_intent_response_async(telegram_request: dict,
+                                       project_id: str, agent: str,
+                                       language_code: str, location_id: str) -> str:
+    """Asynchronously processes a Telegram request and returns a response using Dialogflow.
+
+    Uses the asyncio Sessions client so the Dialogflow round trip does not
+    block the event loop serving other chats.
+
+    Args:
+        telegram_request: Dictionary containing the Telegram user request.
+        project_id: Google Cloud Project ID.
+        agent: Dialogflow agent ID.
+        language_code: Language code for Dialogflow.
+        location_id: Location ID for Dialogflow.
+
+    Returns:
+        str: The response text generated by Dialogflow.
+    """
+
+    session_id = telegram_request['message']['chat']['id']
+    session_path = f"{agent}/sessions/{session_id}"
+    session_client = sessions_client_pool.get_async(location_id)
+
+    text_input = session.TextInput(text=telegram_request['message']['text'])
+    query_input = session.QueryInput(text=text_input, language_code=language_code)
+    request = session.DetectIntentRequest(
+        session=session_path, query_input=query_input
+    )
+    start = time.perf_counter()
+    response = await session_client.detect_intent(request=request)
+    sessions_client_pool.record(location_id, time.perf_counter() - start)
+
+    response_messages = [
+        " ".join(msg.text.text) for msg in response.query_result.response_messages
+    ]
+
+    return ' '.join(response_messages)
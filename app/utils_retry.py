@@ -0,0 +1,222 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable
+
+# Request priorities for the shared limiter, lower values are served first
+PRIORITY_TEXT = 0
+PRIORITY_IMAGE = 1
+PRIORITY_AUDIO = 2
+PRIORITY_VIDEO = 3
+
+
+def is_retryable(error: Exception) -> bool:
+    """Returns True for throttling and transient errors worth retrying."""
+    try:
+        from google.api_core import exceptions
+        if isinstance(error, (exceptions.TooManyRequests, exceptions.ResourceExhausted,
+                              exceptions.ServiceUnavailable, exceptions.DeadlineExceeded)):
+            return True
+    except ImportError:
+        pass
+    return "429" in str(error) or "503" in str(error)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter, so retries of a burst spread out."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and coroutines.
+
+    Tokens refill at ``rate`` per second up to ``capacity``. When callers have
+    to wait, the one with the lowest priority value is served first, in
+    arrival order within a priority. Only the caller at the head of the queue
+    waits for the refill; each take or cancellation wakes the next one, so
+    queued callers use burst tokens as soon as they are available.
+
+    Args:
+        rate: Tokens added per second, e.g. the per-minute quota divided by 60.
+        capacity: Maximum burst size.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._waiters = []  # heap of (priority, sequence, wake)
+        self._sequence = itertools.count()
+
+    def _try_take(self, entry):
+        """Takes a token for `entry` if it is its turn.
+
+        Returns:
+            0 once the token is taken, the seconds until the next token if
+            `entry` is at the head of the queue, or None to wait until woken.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._waiters[0] != entry:
+                return None
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._wake_head()
+            return 0
+
+    def _wake_head(self):
+        if self._waiters:
+            try:
+                self._waiters[0][2]()
+            except RuntimeError:
+                # The waiter's event loop is closed; its task was cancelled and dequeues itself
+                pass
+
+    def _enqueue(self, priority: int, wake: Callable[[], None]):
+        entry = (priority, next(self._sequence), wake)
+        with self._lock:
+            heapq.heappush(self._waiters, entry)
+        return entry
+
+    def _dequeue(self, entry):
+        with self._lock:
+            if entry in self._waiters:
+                was_head = self._waiters[0] == entry
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                if was_head:
+                    self._wake_head()
+
+    def acquire(self, priority: int = PRIORITY_TEXT) -> float:
+        """Blocks until a token is available.
+
+        Returns:
+            float: Seconds spent waiting for the token.
+        """
+        start = time.monotonic()
+        woken = threading.Event()
+        entry = self._enqueue(priority, woken.set)
+        try:
+            while True:
+                woken.clear()
+                wait = self._try_take(entry)
+                if wait == 0:
+                    break
+                woken.wait(wait)
+        except BaseException:
+            self._dequeue(entry)
+            raise
+        return time.monotonic() - start
+
+    async def acquire_async(self, priority: int = PRIORITY_TEXT) -> float:
+        """Waits without blocking the event loop until a token is available.
+
+        Returns:
+            float: Seconds spent waiting for the token.
+        """
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        entry = self._enqueue(priority, lambda: loop.call_soon_threadsafe(woken.set))
+        try:
+            while True:
+                woken.clear()
+                wait = self._try_take(entry)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(woken.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._dequeue(entry)
+            raise
+        return time.monotonic() - start
+
+
+class RetryPolicy:
+    """Rate-limited calls with exponential backoff and jitter on throttling errors.
+
+    Every attempt takes a token from the shared limiter first. Counters of
+    calls, throttled acquisitions, retries and failures are kept in
+    ``metrics``.
+
+    Args:
+        limiter: The TokenBucket shared by all callers of the same quota.
+        max_attempts: Attempts per call, including the first one.
+        base_delay: Backoff base in seconds.
+        max_delay: Upper bound of a single backoff in seconds.
+    """
+
+    def __init__(self, limiter: TokenBucket, max_attempts: int = 3,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = {'calls': 0, 'throttled': 0, 'throttled_seconds': 0.0, 'retried': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, value: float = 1):
+        with self._lock:
+            self.metrics[name] += value
+
+    def _on_wait(self, waited: float):
+        self._count('calls')
+        if waited > 0.001:
+            self._count('throttled')
+            self._count('throttled_seconds', waited)
+
+    def _on_error(self, error: Exception, attempt: int) -> float:
+        """Returns the backoff before the next attempt, or raises if the call should fail."""
+        if not is_retryable(error) or attempt + 1 >= self.max_attempts:
+            self._count('failed')
+            raise error
+        self._count('retried')
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        logging.warning(f"Retryable error ({error}), retrying in {delay:.1f} seconds. Metrics: {self.metrics}")
+        return delay
+
+    def call(self, func: Callable, *args, priority: int = PRIORITY_TEXT, **kwargs) -> Any:
+        """Calls `func` with rate limiting and retries, blocking the thread."""
+        for attempt in range(self.max_attempts):
+            self._on_wait(self.limiter.acquire(priority))
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._on_error(e, attempt))
+
+    async def call_async(self, func: Callable, *args, priority: int = PRIORITY_TEXT, **kwargs) -> Any:
+        """Awaits `func` with rate limiting and retries."""
+        for attempt in range(self.max_attempts):
+            self._on_wait(await self.limiter.acquire_async(priority))
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._on_error(e, attempt))
@@ -0,0 +1,115 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from utils_metrics import Metrics
+
+
+def split_text(text: str, max_length: int) -> list:
+    """Splits a text into chunks of at most `max_length`, preferring line and word breaks.
+
+    Args:
+        text: The text to split.
+        max_length: Maximum length of each chunk.
+
+    Returns:
+        list: The chunks, in order.
+    """
+    chunks = []
+    while len(text) > max_length:
+        cut = text.rfind("\n", 0, max_length + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, max_length + 1)
+        if cut <= 0:
+            cut = max_length
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """Replies to a Telegram message with text that arrives in pieces.
+
+    The reply is sent as soon as the first text arrives and edited as more
+    comes in, at most once every `edit_interval` seconds to stay within
+    Telegram's edit rate limits. Text longer than `max_length` continues in
+    follow-up messages instead of being truncated.
+
+    Args:
+        message: The user's message to reply to.
+        max_length: Maximum length of each Telegram message.
+        edit_interval: Minimum seconds between two edits.
+        metrics: Records each send and edit as a ``telegram_send`` stage; no-op by default.
+    """
+
+    def __init__(self, message: Message, max_length: int, edit_interval: float, metrics: Metrics = None):
+        self.message = message
+        self.max_length = max_length
+        self.edit_interval = edit_interval
+        self.metrics = metrics or Metrics('bot')
+        self._buffer = ""
+        self._sent = []  # (telegram message, text currently shown)
+        self._next_edit = 0.0
+
+    async def append(self, text: str):
+        """Adds text to the reply, updating Telegram if the edit interval has passed."""
+        self._buffer += text
+        if time.monotonic() >= self._next_edit:
+            await self._flush()
+
+    async def finish(self):
+        """Sends whatever text is still pending."""
+        while True:
+            try:
+                await self._flush(final=True)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def _flush(self, final: bool = False):
+        if not self._buffer.strip():
+            return
+        try:
+            for index, chunk in enumerate(split_text(self._buffer, self.max_length)):
+                if index < len(self._sent):
+                    sent, shown = self._sent[index]
+                    if chunk != shown:
+                        with self.metrics.span('telegram_send') as span:
+                            span['bytes'] = len(chunk.encode('utf-8'))
+                            await sent.edit_text(chunk)
+                        self._sent[index] = (sent, chunk)
+                else:
+                    with self.metrics.span('telegram_send') as span:
+                        span['bytes'] = len(chunk.encode('utf-8'))
+                        sent = await self.message.reply_text(chunk)
+                    self._sent.append((sent, chunk))
+        except RetryAfter as e:
+            if final:
+                raise
+            logging.warning(f"Telegram edit limit reached, pausing edits for {e.retry_after} seconds")
+            self._next_edit = time.monotonic() + e.retry_after
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._next_edit = time.monotonic() + self.edit_interval
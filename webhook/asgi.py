@@ -0,0 +1,194 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ASGI entry point of the webhook, an async alternative to the functions-framework one.
+# It runs the same request flows as main.dialogflow_webhook, but Gemini and Discovery
+# Engine calls are awaited and blocking calls (BigQuery, the schema cache, local
+# indexes) run in worker threads, so one instance keeps many fulfillments in flight:
+#
+#     uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from main import chat_sessions, webhook_flow, hybrid_timeout
+from utils_bq import get_chat_response_async
+from utils_ds import search_sample_async
+from configs import (
+    PROJECT_ID,
+    DATASTORE_ID,
+    DATASTORE_LOCATION,
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_THREADS
+)
+
+# Limits the fulfillments handled at once; created on startup, inside the server's event loop
+request_semaphore = None
+
+
+async def app(scope, receive, send):
+    """ASGI application: POST requests carry a Dialogflow CX webhook request."""
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+
+    if scope['method'] != 'POST':
+        await send_json(send, 405, {"error": "Method not allowed."})
+        return
+
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    try:
+        req = json.loads(body)
+    except ValueError:
+        await send_json(send, 400, {"error": "Invalid JSON."})
+        return
+
+    async with request_semaphore:
+        response = await run_flow_async(webhook_flow(req))
+    await send_json(send, 200, response)
+
+async def handle_lifespan(receive, send):
+    """Sets up the worker threads and the concurrency limit on startup."""
+    global request_semaphore
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # BigQuery and the local catalog have no async client and run in these threads
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WEBHOOK_THREADS))
+            request_semaphore = asyncio.Semaphore(WEBHOOK_MAX_CONCURRENCY)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def send_json(send, status: int, payload: Dict):
+    """Sends a JSON response."""
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def run_flow_async(flow):
+    """Async version of `main.run_flow`: runs a request flow, awaiting each of its steps.
+
+    Args:
+        flow: A request flow generator, e.g. `main.webhook_flow(req)`.
+
+    Returns:
+        The value returned by the flow.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = flow.throw(error) if error is not None else flow.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = await run_step_async(step), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        # Runs the flow's cleanup (e.g. session release) when its task is cancelled
+        flow.close()
+
+async def run_step_async(step: tuple):
+    """Async version of `main.run_step`: performs one step of a request flow.
+
+    Args:
+        step: The step yielded by the flow.
+
+    Returns:
+        The result sent back to the flow.
+    """
+    kind, *args = step
+    if kind == 'gemini':
+        chat, prompt, generation_config, stage = args
+        return await get_chat_response_async(chat, prompt, generation_config, stage=stage)
+    if kind == 'search':
+        user_query, fast = args
+        return await search_sample_async(PROJECT_ID, DATASTORE_LOCATION, DATASTORE_ID, user_query, fast=fast)
+    if kind == 'blocking':
+        func, *func_args = args
+        return await asyncio.to_thread(func, *func_args)
+    if kind == 'session':
+        return await get_session_async(args[0])
+    if kind == 'hybrid':
+        return await run_hybrid_async(args[0])
+    raise ValueError(f"Unknown request flow step: {kind}")
+
+async def get_session_async(session_id: str):
+    """Locks a session in a worker thread and returns its chat, without blocking the event loop.
+
+    If the request is cancelled while the thread still waits for the lock,
+    the session is released as soon as the thread gets it, since the
+    cancelled flow can no longer do so.
+
+    Args:
+        session_id: The Dialogflow session ID.
+
+    Returns:
+        The ChatSession of the session.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(chat_sessions.get, session_id))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        def release_abandoned(done):
+            if not done.cancelled() and done.exception() is None:
+                chat_sessions.release(session_id)
+        future.add_done_callback(release_abandoned)
+        raise
+
+async def run_hybrid_async(flows: Dict) -> Dict:
+    """Async version of `main.run_hybrid`: runs the paths of a hybrid request as tasks.
+
+    Args:
+        flows: Request flows keyed by path, 'bq' and 'ds'.
+
+    Returns:
+        Dict: The results of the paths that finished in time, keyed by path.
+    """
+    tasks = {asyncio.ensure_future(run_flow_async(flow)): path for path, flow in flows.items()}
+    results = {}
+    pending = set(tasks)
+    timeout = None
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            logging.info(f"Hybrid routing ignored the slower path: {[tasks[t] for t in pending]}")
+            for task in pending:
+                task.cancel()
+            break
+        for task in done:
+            try:
+                results[tasks[task]] = task.result()
+            except Exception as e:
+                logging.error(f"Hybrid {tasks[task]} path failed: {e}")
+        timeout = hybrid_timeout(results)
+    return results
@@ -26,8 +26,77 @@ LOCATION_ID = os.getenv('LOCATION_ID')
 BQ_DATASET = os.getenv('BQ_DATASET')
 BQ_TABLE = os.getenv('BQ_TABLE')
 BQ_LOCATION = os.getenv('BQ_LOCATION')
+# Path to products_catalog.csv to answer queries locally with DuckDB (empty to disable)
+LOCAL_CATALOG_PATH = os.getenv('LOCAL_CATALOG_PATH', '')
+# Seconds before the cached table schema is revalidated
+SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', 300))
 # Datstore variables
 DATASTORE_ID = os.getenv('DATASTORE_ID')
 DATASTORE_LOCATION = os.getenv('DATASTORE_LOCATION')
+DS_CACHE_TTL = int(os.getenv('DS_CACHE_TTL', 3600))
+DS_CACHE_MAXSIZE = int(os.getenv('DS_CACHE_MAXSIZE', 500))
+# Results summarized in fast search mode
+DS_FAST_PAGE_SIZE = int(os.getenv('DS_FAST_PAGE_SIZE', 3))
+# Retrieval backend for ds_webhook: 'discovery' (Discovery Engine) or 'local' (vector index)
+DS_BACKEND = os.getenv('DS_BACKEND', 'discovery')
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', 'vector_index')
+VECTOR_PAPERS_DIR = os.getenv('VECTOR_PAPERS_DIR', '../papers')
+# Embedder of the local index: 'vertex' or 'hashing' (offline, no cloud calls)
+VECTOR_EMBEDDER = os.getenv('VECTOR_EMBEDDER', 'vertex')
+VECTOR_EMBEDDING_MODEL = os.getenv('VECTOR_EMBEDDING_MODEL', 'text-embedding-004')
+VECTOR_TOP_K = int(os.getenv('VECTOR_TOP_K', 5))
+VECTOR_MIN_SCORE = float(os.getenv('VECTOR_MIN_SCORE', 0.3))
 # Gemini Model
-MODEL = os.getenv('MODEL')
\ No newline at end of file
+MODEL = os.getenv('MODEL')
+# Chat sessions
+CHAT_MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', 500))
+CHAT_SESSION_TTL = int(os.getenv('CHAT_SESSION_TTL', 1800))
+CHAT_MAX_HISTORY = int(os.getenv('CHAT_MAX_HISTORY', 10))
+CHAT_MAX_MEMORY_BYTES = int(os.getenv('CHAT_MAX_MEMORY_BYTES', 50000000))
+# Answer cache ('memory' or 'redis')
+ANSWER_CACHE_BACKEND = os.getenv('ANSWER_CACHE_BACKEND', 'memory')
+ANSWER_CACHE_REDIS_URL = os.getenv('ANSWER_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+SQL_CACHE_TTL = int(os.getenv('SQL_CACHE_TTL', 3600))
+SQL_CACHE_MAXSIZE = int(os.getenv('SQL_CACHE_MAXSIZE', 1000))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 600))
+RESULT_CACHE_MAXSIZE = int(os.getenv('RESULT_CACHE_MAXSIZE', 200))
+# Send a warm-up call to the model at cold start
+WARMUP_MODEL = os.getenv('WARMUP_MODEL', 'true').lower() == 'true'
+# Gemini rate limiting and retries. Each process has its own limiter, so this is its
+# share of the project quota: half by default, the bot uses the other half
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', 30))
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', 5))
+GEMINI_MAX_ATTEMPTS = int(os.getenv('GEMINI_MAX_ATTEMPTS', 3))
+# Hybrid routing between BigQuery and Datastore
+HYBRID_WORKERS = int(os.getenv('HYBRID_WORKERS', 8))
+HYBRID_GRACE_SECONDS = float(os.getenv('HYBRID_GRACE_SECONDS', 2.0))
+HYBRID_FAST_SEARCH = os.getenv('HYBRID_FAST_SEARCH', 'true').lower() == 'true'
+# Query results passed to the answer prompt
+RESULT_MAX_ROWS = int(os.getenv('RESULT_MAX_ROWS', 1000))
+RESULT_TOKEN_BUDGET = int(os.getenv('RESULT_TOKEN_BUDGET', 2000))
+RESULT_TOP_N = int(os.getenv('RESULT_TOP_N', 20))
+
+# Validation of generated SQL before it runs
+SQL_MAX_REPAIRS = int(os.getenv('SQL_MAX_REPAIRS', 2))
+SQL_DRY_RUN = os.getenv('SQL_DRY_RUN', 'true').lower() == 'true'
+SQL_MAX_BYTES_BILLED = int(os.getenv('SQL_MAX_BYTES_BILLED', 1000000000))
+
+# Token budget of the chat history sent with each Gemini call
+CHAT_TOKEN_BUDGET = int(os.getenv('CHAT_TOKEN_BUDGET', 8000))
+CHAT_KEEP_RECENT = int(os.getenv('CHAT_KEEP_RECENT', 4))
+
+# ASGI server mode (asgi.py)
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', 64))
+WEBHOOK_THREADS = int(os.getenv('WEBHOOK_THREADS', 32))
+
+# Pipelined BigQuery execution
+BQ_PIPELINED = os.getenv('BQ_PIPELINED', 'true').lower() == 'true'
+BQ_JOBLESS_QUERIES = os.getenv('BQ_JOBLESS_QUERIES', 'true').lower() == 'true'
+BQ_PAGE_SIZE = int(os.getenv('BQ_PAGE_SIZE', 100))
+BQ_PIPELINE_MIN_ROWS = int(os.getenv('BQ_PIPELINE_MIN_ROWS', 100))
+BQ_PREFETCH_WORKERS = int(os.getenv('BQ_PREFETCH_WORKERS', 4))
+
+# Latency instrumentation: 'none', 'prometheus' or 'otel'. With several Prometheus
+# workers, also set PROMETHEUS_MULTIPROC_DIR to a directory they share
+METRICS_EXPORTER = os.getenv('METRICS_EXPORTER', 'none')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
\ No newline at end of file
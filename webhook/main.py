@@ -15,9 +15,12 @@
 # limitations under the License.
 
 import functions_framework
-from utils_bq import run_query, get_chat_response
+from utils_bq import run_query, run_query_arrow, stream_query_arrow, dry_run_query, get_chat_response, sql_generation_config, start_request_usage, metrics, get_table_last_modified, get_model, start_sql_chat, warm_up
 from utils_ds import search_sample
-import vertexai
+from utils_cache import SchemaCache, SessionRegistry, make_cache, normalize_question, hash_text
+from utils_results import render_results
+from utils_tokens import estimate_tokens
+from utils_sql import SqlValidationError, parse_schema_columns, validate_sql, rows_needed, extract_sql_query, record_sql_outcome
 from configs import (
     PROJECT_ID, 
     BQ_DATASET, 
@@ -25,129 +28,592 @@ from configs import (
     LOCATION_ID, 
     DATASTORE_ID, 
     DATASTORE_LOCATION,
-    MODEL
+    SCHEMA_CACHE_TTL,
+    WARMUP_MODEL,
+    CHAT_MAX_SESSIONS,
+    CHAT_SESSION_TTL,
+    CHAT_MAX_HISTORY,
+    CHAT_MAX_MEMORY_BYTES,
+    ANSWER_CACHE_BACKEND,
+    ANSWER_CACHE_REDIS_URL,
+    SQL_CACHE_TTL,
+    SQL_CACHE_MAXSIZE,
+    RESULT_CACHE_TTL,
+    RESULT_CACHE_MAXSIZE,
+    LOCAL_CATALOG_PATH,
+    HYBRID_WORKERS,
+    HYBRID_GRACE_SECONDS,
+    HYBRID_FAST_SEARCH,
+    DS_BACKEND,
+    VECTOR_INDEX_DIR,
+    VECTOR_EMBEDDER,
+    VECTOR_EMBEDDING_MODEL,
+    VECTOR_TOP_K,
+    VECTOR_MIN_SCORE,
+    RESULT_MAX_ROWS,
+    RESULT_TOKEN_BUDGET,
+    RESULT_TOP_N,
+    SQL_MAX_REPAIRS,
+    SQL_DRY_RUN,
+    SQL_MAX_BYTES_BILLED,
+    BQ_PIPELINED,
+    BQ_PIPELINE_MIN_ROWS,
+    BQ_PREFETCH_WORKERS
 )
-from vertexai.generative_models import GenerativeModel
 from typing import List, Dict
 from prompts import (
     BQ_SQL_GENERATION_PROMPT, 
+    BQ_SQL_REPAIR_PROMPT,
     BQ_RESPONSE_GENERATION_PROMPT, 
     DATASTORE_RESPONSE_PROMPT,
+    HYBRID_RESPONSE_PROMPT,
     BQ_GET_COLUMNS_SQL
 )
 from vertexai.generative_models import ChatSession
+from google.api_core.exceptions import BadRequest, GoogleAPICallError, RetryError
+from google.auth.exceptions import GoogleAuthError
+import contextvars
 import logging
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 logging.basicConfig(
     level=logging.INFO,  # Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'  # Define the log message format
 )
 
-# Create a global chat session to preserve context across requests
-chat = None
+# One chat session per Dialogflow session, with bounded history and memory
+chat_sessions = SessionRegistry(
+    factory=lambda: get_model().start_chat(),
+    max_sessions=CHAT_MAX_SESSIONS,
+    ttl=CHAT_SESSION_TTL,
+    max_history=CHAT_MAX_HISTORY,
+    max_bytes=CHAT_MAX_MEMORY_BYTES,
+)
+
+# Two-level answer cache: question -> SQL and SQL -> query results
+sql_cache = make_cache(ANSWER_CACHE_BACKEND, 'sql', SQL_CACHE_MAXSIZE, SQL_CACHE_TTL, ANSWER_CACHE_REDIS_URL)
+result_cache = make_cache(ANSWER_CACHE_BACKEND, 'results', RESULT_CACHE_MAXSIZE, RESULT_CACHE_TTL, ANSWER_CACHE_REDIS_URL)
+
+# Optional embedded copy of the catalog, used before sending queries to BigQuery
+local_catalog = None
+if LOCAL_CATALOG_PATH:
+    from utils_local import LocalCatalog
+    local_catalog = LocalCatalog(LOCAL_CATALOG_PATH, PROJECT_ID, BQ_DATASET, BQ_TABLE)
+
+# Local vector index over the papers, used instead of the Discovery Engine datastore
+vector_index = None
+if DS_BACKEND == 'local':
+    from utils_vector import VectorIndex, make_embedder
+    vector_index = VectorIndex(VECTOR_INDEX_DIR, make_embedder(VECTOR_EMBEDDER, VECTOR_EMBEDDING_MODEL))
+
+# Threads running the BigQuery and Datastore paths of hybrid requests concurrently
+hybrid_executor = ThreadPoolExecutor(max_workers=HYBRID_WORKERS)
+
+# Threads fetching the remaining pages of pipelined queries while the answer is generated
+prefetch_executor = ThreadPoolExecutor(max_workers=BQ_PREFETCH_WORKERS)
+
+# Request flows are generators that yield their I/O as steps, so the blocking
+# functions-framework entry point below and the async one in asgi.py share the
+# same logic and only differ in how each step is run:
+#   ('gemini', chat, prompt, generation_config, stage): a message to a Gemini chat
+#   ('search', user_query, fast): a Discovery Engine search
+#   ('blocking', func, *args): a call with no async client (BigQuery, caches, local indexes)
+#   ('session', session_id): locks a session and returns its chat; see `SessionRegistry.get`
+#   ('hybrid', flows): flows keyed by path, run concurrently; see `hybrid_timeout`
 
 # Functions-framework --target sql_webhook
 @functions_framework.http
 def dialogflow_webhook(request):
-    global chat
-    # Inicializo el modelo
-    vertexai.init(project=PROJECT_ID, location=LOCATION_ID)
-    model = GenerativeModel(MODEL)
+    return run_flow(webhook_flow(request.get_json()))
 
-    if chat is None:
-        chat = model.start_chat()
+def run_flow(flow):
+    """Runs a request flow, performing each of its steps with blocking calls.
 
-    req = request.get_json()
-    tag = req['fulfillmentInfo']['tag']
+    Errors raised by a step are thrown back into the flow at the step.
+
+    Args:
+        flow: A request flow generator, e.g. `webhook_flow(req)`.
+
+    Returns:
+        The value returned by the flow.
+    """
+    result, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error is not None else flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = run_step(step), None
+        except Exception as e:
+            result, error = None, e
+
+def run_step(step: tuple):
+    """Performs one step of a request flow with blocking calls.
 
-    logging.info(chat)
+    Args:
+        step: The step yielded by the flow.
+
+    Returns:
+        The result sent back to the flow.
+    """
+    kind, *args = step
+    if kind == 'gemini':
+        chat, prompt, generation_config, stage = args
+        return get_chat_response(chat, prompt, generation_config, stage=stage)
+    if kind == 'search':
+        user_query, fast = args
+        return search_sample(PROJECT_ID, DATASTORE_LOCATION, DATASTORE_ID, user_query, fast=fast)
+    if kind == 'blocking':
+        func, *func_args = args
+        return func(*func_args)
+    if kind == 'session':
+        return chat_sessions.get(args[0])
+    if kind == 'hybrid':
+        return run_hybrid(args[0])
+    raise ValueError(f"Unknown request flow step: {kind}")
+
+def run_hybrid(flows: Dict) -> Dict:
+    """Runs the paths of a hybrid request in threads, within the routing grace period.
 
-    # Logica de webhook de bigquery
-    if tag == 'bq_webhook':
-        return handle_bq_webhook(req, chat)
-    elif tag == 'ds_webhook':
-        return handle_ds_webhook(req, chat)
-    else:
-        return {"fulfillment_response": {"messages": [{"text": {"text": ["Invalid webhook tag."]}}]}}
+    Args:
+        flows: Request flows keyed by path, 'bq' and 'ds'.
 
-def handle_bq_webhook(req: Dict, chat: ChatSession) -> Dict:
-    """Handles requests tagged as 'bq_webhook'.
+    Returns:
+        Dict: The results of the paths that finished in time, keyed by path.
+    """
+    # Copy the request context so each path's token usage is counted with the request
+    futures = {
+        hybrid_executor.submit(contextvars.copy_context().run, run_flow, flow): path
+        for path, flow in flows.items()
+    }
+    results = {}
+    pending = set(futures)
+    timeout = None
+    while pending:
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            logging.info(f"Hybrid routing ignored the slower path: {[futures[f] for f in pending]}")
+            break
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logging.error(f"Hybrid {futures[future]} path failed: {e}")
+        timeout = hybrid_timeout(results)
+    return results
+
+def hybrid_timeout(results: Dict):
+    """Returns how long to keep waiting for the other hybrid paths.
+
+    As soon as one path returns a confident answer, the others get at most
+    HYBRID_GRACE_SECONDS more.
+
+    Args:
+        results: The results of the finished paths, keyed by path.
+
+    Returns:
+        float: HYBRID_GRACE_SECONDS, or None to wait without limit.
+    """
+    if any(is_confident(path, result) for path, result in results.items()):
+        return HYBRID_GRACE_SECONDS
+    return None
+
+def webhook_flow(req: Dict):
+    """Request flow of the webhook: dispatches a request on its tag.
 
     Args:
         req: The incoming request dictionary.
-        chat: The global ChatSession object.
 
     Returns:
         Dict: The response dictionary for the webhook.
     """
-    user_query = req['text']
+    tag = req['fulfillmentInfo']['tag']
+    session_id = get_session_id(req)
 
-    logging.info(user_query)
+    # El modelo se construye una sola vez por worker (ver warm_up); only the session is
+    # fetched per request, waiting for any other request of the same session to release it
+    with metrics.span('session_wait'):
+        chat = yield ('session', session_id)
 
-    # Get column information
-    columns_df = get_table_columns()
-    if columns_df is None:
-        return {"fulfillment_response": {"messages": [{"text": {"text": ["Error fetching column information."]}}]}}
+    logging.info(f"Session {session_id}: {len(chat.history)} messages in history, "
+                 f"{len(chat_sessions)} active sessions")
 
-    s_columns = format_columns(columns_df)
+    usage = start_request_usage()
+    try:
+        with metrics.span('request'):
+            # Logica de webhook de bigquery
+            if tag == 'bq_webhook':
+                return (yield from handle_bq_webhook(req, chat))
+            elif tag == 'ds_webhook':
+                return (yield from handle_ds_webhook(req, chat))
+            elif tag == 'hybrid_webhook':
+                return (yield from handle_hybrid_webhook(req, chat))
+            else:
+                return {"fulfillment_response": {"messages": [{"text": {"text": ["Invalid webhook tag."]}}]}}
+    finally:
+        chat_sessions.release(session_id)
+        logging.info(f"Session {session_id} token usage: {usage}")
+
+def get_session_id(req: Dict) -> str:
+    """Extracts the Dialogflow session ID from the request.
 
-    prompt_text = BQ_SQL_GENERATION_PROMPT.format(
-            project_id=PROJECT_ID,
-            dataset=BQ_DATASET,
-            table=BQ_TABLE,
-            columns=s_columns,
-            user_query=user_query,
-        )
+    Args:
+        req: The incoming request dictionary.
 
-    logging.info(prompt_text)
+    Returns:
+        str: The session ID, or 'default' if the request carries no session.
+    """
+    session = req.get('sessionInfo', {}).get('session', '')
+    return session.split('/')[-1] or 'default'
 
-    chat_response = get_chat_response(chat, prompt_text)
-    sql_query = extract_sql_query(chat_response)
+def handle_bq_webhook(req: Dict, chat: ChatSession):
+    """Request flow for requests tagged as 'bq_webhook'.
 
-    logging.info(chat_response)
+    Args:
+        req: The incoming request dictionary.
+        chat: The ChatSession of the Dialogflow session.
 
-    try:
-        query_results = run_query(sql_query)
-        print('SQL query executed successfully.')
-    except Exception as e:
-        print(f'Error executing SQL query: {e}')
-        query_results = "I cannot answer that question based on the available data."
+    Returns:
+        Dict: The response dictionary for the webhook.
+    """
+    user_query = req['text']
 
-    chat_response = get_chat_response(chat, f"""
+    logging.debug(user_query)
+
+    # Get column information from the process-level schema cache
+    s_columns = yield ('blocking', schema_cache.get)
+    if s_columns is None:
+        return {"fulfillment_response": {"messages": [{"text": {"text": ["Error fetching column information."]}}]}}
+
+    query_results = yield from fetch_bq_results(user_query, s_columns, chat)
+
+    chat_response = yield ('gemini', chat, f"""
         System: 
         ```
-        {query_results.to_markdown()}
+        {format_query_results(query_results)}
         ```
         Answer the user's question using this information. Do not generate SQL code.
 
         User: {user_query}
         AI: 
-    """)
+    """, None, 'answer_generation')
 
     return {"fulfillment_response": {"messages": [{"text": {"text": [chat_response]}}]}}
 
-def handle_ds_webhook(req: Dict, chat: ChatSession) -> Dict:
-    """Handles requests tagged as 'ds_webhook'.
+def handle_ds_webhook(req: Dict, chat: ChatSession):
+    """Request flow for requests tagged as 'ds_webhook'.
 
     Args:
         req: The incoming request dictionary.
-        chat: The global ChatSession object.
+        chat: The ChatSession of the Dialogflow session.
 
     Returns:
         Dict: The response dictionary for the webhook.
     """
     user_query = req['text']
 
-    summary = search_sample(PROJECT_ID, DATASTORE_LOCATION, DATASTORE_ID, user_query).summary.summary_text
+    summary, _ = yield from fetch_ds_summary(user_query)
 
     prompt_text = DATASTORE_RESPONSE_PROMPT.format(
             summary=summary,
             user_query=user_query,
         )
-    chat_response = get_chat_response(chat, prompt_text)
+    chat_response = yield ('gemini', chat, prompt_text, None, 'answer_generation')
+
+    return {"fulfillment_response": {"messages": [{"text": {"text": [chat_response]}}]}}
+
+def handle_hybrid_webhook(req: Dict, chat: ChatSession):
+    """Request flow for requests tagged as 'hybrid_webhook', for questions that may need either source.
+
+    SQL generation plus BigQuery and the Datastore search run concurrently. As
+    soon as one path returns a confident answer, the other one gets at most
+    HYBRID_GRACE_SECONDS more; a path that is still running after that is
+    ignored. Confident results are merged into a single answer.
+
+    Args:
+        req: The incoming request dictionary.
+        chat: The ChatSession of the Dialogflow session.
+
+    Returns:
+        Dict: The response dictionary for the webhook.
+    """
+    user_query = req['text']
+
+    s_columns = yield ('blocking', schema_cache.get)
+    # The SQL path generates in its own chat, so an ignored, still running call cannot touch the session history
+    flows = {'ds': fetch_ds_summary(user_query, HYBRID_FAST_SEARCH)}
+    if s_columns is not None:
+        flows['bq'] = fetch_bq_results(user_query, s_columns, chat)
+    results = yield ('hybrid', flows)
+
+    query_results = results.get('bq')
+    bq_confident = is_confident('bq', query_results)
+    summary, ds_confident = results.get('ds', ("", False))
+    logging.info(f"Hybrid routing confidence: bq={bq_confident} ds={ds_confident}")
+
+    prompt_text = HYBRID_RESPONSE_PROMPT.format(
+            query_results=format_query_results(query_results) if bq_confident else "",
+            summary=summary if ds_confident else "",
+            user_query=user_query,
+        )
+    chat_response = yield ('gemini', chat, prompt_text, None, 'answer_generation')
 
     return {"fulfillment_response": {"messages": [{"text": {"text": [chat_response]}}]}}
 
+def is_confident(path: str, result) -> bool:
+    """Tells whether a hybrid routing path produced a usable answer.
+
+    Args:
+        path: 'bq' or 'ds'.
+        result: The value returned by `fetch_bq_results` or `fetch_ds_summary`.
+
+    Returns:
+        bool: True for non-empty query results or a Datastore summary that was not skipped.
+    """
+    if path == 'bq':
+        return result is not None and not isinstance(result, str) and result[0].num_rows > 0
+    return result is not None and result[1]
+
+def fetch_bq_results(user_query: str, s_columns: str, chat: ChatSession):
+    """Request flow that generates SQL for a question and runs it, using the answer cache.
+
+    Args:
+        user_query: The user's question.
+        s_columns: The formatted column block of the table.
+        chat: The ChatSession of the Dialogflow session. The SQL is generated in
+              a separate chat on the model of the column block, seeded with its history.
+
+    Returns:
+        The query results, or a message string if the query failed.
+    """
+    # First level: normalized question (and schema) -> generated SQL. A follow-up
+    # can depend on the conversation, so only SQL generated without history is shared
+    cacheable = not chat.history
+    question_key = f"{hash_text(s_columns)}:{normalize_question(user_query)}"
+    sql_query = (yield ('blocking', sql_cache.get, question_key)) if cacheable else None
+
+    if sql_query is None:
+        prompt_text = BQ_SQL_GENERATION_PROMPT.format(user_query=user_query)
+        sql_chat = start_sql_chat(s_columns, chat.history)
+
+        logging.debug(prompt_text)
+
+        chat_response = yield ('gemini', sql_chat, prompt_text, sql_generation_config, 'sql_generation')
+        generated = extract_sql_query(chat_response)
+
+        logging.debug(chat_response)
+
+        if not generated['answerable']:
+            record_sql_outcome('unanswerable')
+            logging.info(f"Question not answerable from the table: {generated['reason']}")
+            return f"I cannot answer that question based on the available data. {generated['reason']}".strip()
+        record_sql_outcome('answerable')
+        sql_query = generated['sql']
+
+        try:
+            sql_query = yield from validate_sql_query(sql_query, s_columns, sql_chat)
+        except SqlValidationError as e:
+            logging.warning(f'Generated SQL rejected: {e}')
+            return "I cannot answer that question based on the available data."
+
+    # Second level: SQL text -> query results
+    query_results = yield ('blocking', result_cache.get, sql_query)
+
+    if query_results is None:
+        try:
+            with metrics.span('bq_execution') as span:
+                query_results = yield ('blocking', execute_query, sql_query)
+                span['bytes'] = query_results[0].nbytes
+            if cacheable:
+                yield ('blocking', sql_cache.set, question_key, sql_query)
+            # Partial pipelined results are cached by the prefetch once complete
+            if is_complete(query_results):
+                yield ('blocking', result_cache.set, sql_query, query_results)
+        except Exception as e:
+            logging.error(f'Error executing SQL query: {e}')
+            query_results = "I cannot answer that question based on the available data."
+
+    return query_results
+
+def validate_sql_query(sql_query: str, s_columns: str, chat: ChatSession):
+    """Request flow that validates generated SQL, asking the model to repair it when it is rejected.
+
+    The query is checked against the table and the cached column block, then
+    dry-run on BigQuery to estimate the bytes it would scan. If the dry run
+    itself fails (permissions, availability, network), it is skipped and
+    SQL_MAX_BYTES_BILLED still caps the query when it runs.
+
+    Args:
+        sql_query: The generated SQL query.
+        s_columns: The formatted column block of the table.
+        chat: The ChatSession that generated the SQL.
+
+    Returns:
+        str: The validated SQL query.
+
+    Raises:
+        SqlValidationError: If the query is still rejected after SQL_MAX_REPAIRS repairs.
+    """
+    columns = parse_schema_columns(s_columns)
+    for attempt in range(SQL_MAX_REPAIRS + 1):
+        try:
+            sql_query = validate_sql(sql_query, columns, PROJECT_ID, BQ_DATASET, BQ_TABLE)
+            if SQL_DRY_RUN and local_catalog is None:
+                try:
+                    with metrics.span('bq_dry_run') as span:
+                        bytes_processed = yield ('blocking', dry_run_query, sql_query)
+                        span['bytes'] = bytes_processed
+                except BadRequest:
+                    raise
+                except (GoogleAPICallError, RetryError, GoogleAuthError, OSError) as e:
+                    # Not a problem of the query: run it without the estimate, maximum_bytes_billed still caps its cost
+                    logging.warning(f"Dry run failed, skipping it: {e}")
+                else:
+                    logging.info(f"Dry run: the query would process {bytes_processed} bytes")
+                    if bytes_processed > SQL_MAX_BYTES_BILLED:
+                        raise SqlValidationError(
+                            f"The query would process {bytes_processed} bytes, over the limit of {SQL_MAX_BYTES_BILLED}.")
+            return sql_query
+        except (SqlValidationError, BadRequest) as e:
+            error = e
+            logging.info(f"Generated SQL rejected (attempt {attempt + 1}): {e}")
+
+        if attempt < SQL_MAX_REPAIRS:
+            chat_response = yield ('gemini', chat, BQ_SQL_REPAIR_PROMPT.format(sql_query=sql_query, error=error),
+                                   sql_generation_config, 'sql_repair')
+            repaired = extract_sql_query(chat_response)
+            if not repaired['answerable']:
+                raise SqlValidationError(repaired['reason'] or str(error))
+            sql_query = repaired['sql']
+
+    raise SqlValidationError(str(error))
+
+def format_query_results(query_results) -> str:
+    """Renders query results for the answer prompt within the result token budget.
+
+    Args:
+        query_results: The value returned by `fetch_bq_results`.
+
+    Returns:
+        str: The rendered results, or the message string returned on failure.
+    """
+    if isinstance(query_results, str):
+        return query_results
+    table, total_rows = query_results
+    return render_results(table, total_rows, RESULT_TOKEN_BUDGET, RESULT_TOP_N)
+
+def fetch_ds_summary(user_query: str, fast: bool = False):
+    """Request flow that searches the Datastore, or the local vector index, and returns its summary.
+
+    With the local backend the summary is made of the top-k chunks.
+
+    Args:
+        user_query: The user's question.
+        fast: Use the fast search mode (fewer results, no snippets).
+
+    Returns:
+        tuple: The summary text, and False if the search skipped the summary
+               (e.g. no relevant results) or returned none.
+    """
+    with metrics.span('ds_search') as span:
+        if vector_index is not None:
+            chunks = yield ('blocking', vector_index.search, user_query, VECTOR_TOP_K)
+            summary_text = "\n\n".join(f"[{chunk['source']}, p. {chunk['page']}] {chunk['text']}" for chunk in chunks)
+            span['bytes'] = len(summary_text.encode('utf-8'))
+            return summary_text, bool(chunks) and chunks[0]['score'] >= VECTOR_MIN_SCORE
+
+        summary = (yield ('search', user_query, fast)).summary
+        span['bytes'] = len(summary.summary_text.encode('utf-8'))
+    confident = bool(summary.summary_text) and not summary.summary_skipped_reasons
+    return summary.summary_text, confident
+
+def execute_query(sql_query: str):
+    """Runs a query on the local catalog when enabled, falling back to BigQuery.
+
+    Args:
+        sql_query: The generated SQL query.
+
+    Returns:
+        tuple: At most RESULT_MAX_ROWS rows as a `pyarrow.Table` and the total
+               number of rows, or None if BigQuery failed.
+    """
+    if local_catalog is not None:
+        try:
+            return local_catalog.run_query(sql_query, RESULT_MAX_ROWS)
+        except Exception as e:
+            logging.info(f"Query not supported locally, falling back to BigQuery: {e}")
+    if BQ_PIPELINED:
+        return execute_query_pipelined(sql_query)
+    return run_query_arrow(sql_query, RESULT_MAX_ROWS, SQL_MAX_BYTES_BILLED)
+
+def execute_query_pipelined(sql_query: str):
+    """Runs a query on BigQuery and returns as soon as there are enough rows to answer.
+
+    How many rows are enough depends on the query: its LIMIT, one row for an
+    aggregate, or BQ_PIPELINE_MIN_ROWS. The remaining pages are fetched in the
+    background while the answer is generated, and the complete results are
+    then stored in the result cache.
+
+    Args:
+        sql_query: The validated SQL query.
+
+    Returns:
+        tuple: The rows fetched so far as a `pyarrow.Table` and the total number of rows.
+
+    Raises:
+        Exception: If the query fails.
+    """
+    needed = rows_needed(sql_query, BQ_PIPELINE_MIN_ROWS)
+    pages = stream_query_arrow(sql_query, RESULT_MAX_ROWS, SQL_MAX_BYTES_BILLED)
+    batches = []
+    fetched = 0
+    total_rows = 0
+    for batch, total_rows in pages:
+        batches.append(batch)
+        fetched += batch.num_rows
+        if fetched >= needed:
+            break
+    table = pa.Table.from_batches(batches).slice(0, RESULT_MAX_ROWS) if batches else pa.table({})
+    query_results = (table, total_rows)
+    if not is_complete(query_results):
+        logging.info(f"Pipelined query: answering from {table.num_rows} of {total_rows} rows")
+        prefetch_executor.submit(finish_query, sql_query, pages, batches, total_rows)
+    return query_results
+
+def finish_query(sql_query: str, pages, batches: List, total_rows: int):
+    """Fetches the remaining pages of a pipelined query and caches the complete results.
+
+    Args:
+        sql_query: The SQL query, used as the result cache key.
+        pages: The page generator returned by `stream_query_arrow`, partly consumed.
+        batches: The record batches fetched so far.
+        total_rows: The total number of rows of the result.
+    """
+    try:
+        fetched = sum(batch.num_rows for batch in batches)
+        for batch, total_rows in pages:
+            batches.append(batch)
+            fetched += batch.num_rows
+            if fetched >= RESULT_MAX_ROWS:
+                break
+        result_cache.set(sql_query, (pa.Table.from_batches(batches).slice(0, RESULT_MAX_ROWS), total_rows))
+    except Exception as e:
+        logging.error(f"Error fetching the remaining pages of a query: {e}")
+
+def is_complete(query_results) -> bool:
+    """Tells whether query results hold every row up to RESULT_MAX_ROWS.
+
+    Args:
+        query_results: A (table, total_rows) tuple.
+
+    Returns:
+        bool: False for the partial results of a pipelined query.
+    """
+    table, total_rows = query_results
+    return table.num_rows >= min(total_rows, RESULT_MAX_ROWS)
+
 def get_table_columns() -> List:
     """Fetches column information from BigQuery.
 
@@ -164,9 +630,23 @@ def get_table_columns() -> List:
         return columns_df
 
     except Exception as e:
-        print(f"Error fetching column information: {e}")
+        logging.error(f"Error fetching column information: {e}")
         return None
 
+def load_columns_block() -> str:
+    """Fetches the table columns and formats them for the prompt.
+
+    Returns:
+        str: The formatted column block, or None if the columns could not be fetched.
+    """
+    with metrics.span('schema_fetch') as span:
+        columns_df = get_table_columns()
+        if columns_df is None:
+            return None
+        s_columns = format_columns(columns_df)
+        span['tokens'] = estimate_tokens(s_columns)
+    return s_columns
+
 def format_columns(columns_df) -> str:
     """Formats column information for the prompt.
 
@@ -176,18 +656,15 @@ def format_columns(columns_df) -> str:
     Returns:
         str: The formatted string of columns.
     """
-    return "\n".join(f"- {row['column_name']} ({row['data_type']})" for _, row in columns_df.iterrows())
-
-def extract_sql_query(chat_response: str) -> str:
-    """Extracts the SQL query from the chat response.
-
-    Args:
-        chat_response: The response from the chat model.
+    return ("- " + columns_df['column_name'] + " (" + columns_df['data_type'] + ")").str.cat(sep="\n")
+
+# Process-level schema cache, revalidated every SCHEMA_CACHE_TTL seconds and
+# reloaded when the table's last_modified_time changes
+schema_cache = SchemaCache(
+    loader=load_columns_block,
+    version_fn=lambda: get_table_last_modified(f"{PROJECT_ID}.{BQ_DATASET}.{BQ_TABLE}"),
+    ttl=SCHEMA_CACHE_TTL,
+)
 
-    Returns:
-        str: The extracted SQL query.
-    """
-    # Add logic to reliably extract SQL query from the chat response
-    # For example, you can use regular expressions or string manipulation
-    # based on how the model formats its output.
-    return chat_response.replace('```sql', '').replace('```', '').strip()
\ No newline at end of file
+# Build the schema cache and its model at cold start instead of on the first request
+warm_up(ping=WARMUP_MODEL, s_columns=schema_cache.get() if WARMUP_MODEL else None)
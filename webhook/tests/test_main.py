@@ -37,7 +37,13 @@ def test_handle_ds_webhook_2():
     response = dialogflow_webhook(request)
     print(response)  # Check the structure of the response
 
+def test_handle_hybrid_webhook():
+    request = MagicMock(get_json=lambda: {'fulfillmentInfo': {'tag': 'hybrid_webhook'}, 'text': 'What is the average price of products?'})
+    response = dialogflow_webhook(request)
+    print(response)  # Check the structure of the response
+
 if __name__ == '__main__':
     test_handle_bq_webhook()
     test_handle_ds_webhook()
-    test_handle_ds_webhook_2()
\ No newline at end of file
+    test_handle_ds_webhook_2()
+    test_handle_hybrid_webhook()
\ No newline at end of file
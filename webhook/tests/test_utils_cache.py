@@ -0,0 +1,157 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+import threading
+import time
+from utils_cache import SchemaCache, SessionRegistry, TTLCache, normalize_question
+
+def wait_for_refresh(cache):
+    for _ in range(100):
+        if not cache._refreshing:
+            return
+        time.sleep(0.01)
+
+def test_schema_cache_loads_once_within_ttl():
+    calls = []
+    cache = SchemaCache(loader=lambda: calls.append(1) or "- a (STRING)", version_fn=lambda: 1, ttl=60)
+    assert cache.get() == "- a (STRING)"
+    assert cache.get() == "- a (STRING)"
+    assert len(calls) == 1
+
+def test_schema_cache_keeps_value_when_version_unchanged():
+    calls = []
+    cache = SchemaCache(loader=lambda: calls.append(1) or "- a (STRING)", version_fn=lambda: 1, ttl=0)
+    cache.get()
+    cache.get()
+    wait_for_refresh(cache)
+    assert len(calls) == 1
+
+def test_schema_cache_reloads_when_version_changes():
+    versions = iter([1, 2, 2])
+    values = iter(["- a (STRING)", "- b (INT64)"])
+    cache = SchemaCache(loader=lambda: next(values), version_fn=lambda: next(versions), ttl=0)
+    assert cache.get() == "- a (STRING)"
+    assert cache.get() == "- a (STRING)"  # Stale value served while refreshing
+    wait_for_refresh(cache)
+    assert cache.get() == "- b (INT64)"
+
+def test_schema_cache_retries_failed_load():
+    values = iter([None, "- a (STRING)"])
+    cache = SchemaCache(loader=lambda: next(values), version_fn=lambda: 1, ttl=60)
+    assert cache.get() is None
+    assert cache.get() == "- a (STRING)"
+
+class FakePart:
+    def __init__(self, text):
+        self.text = text
+
+class FakeContent:
+    def __init__(self, text):
+        self.parts = [FakePart(text)]
+
+class FakeChat:
+    def __init__(self):
+        self._history = []
+
+    def send(self, text):
+        self._history += [FakeContent(text), FakeContent(text)]
+
+def make_registry(**kwargs):
+    options = dict(max_sessions=10, ttl=60, max_history=4, max_bytes=10000)
+    options.update(kwargs)
+    return SessionRegistry(factory=FakeChat, **options)
+
+def use(registry, session_id):
+    chat = registry.get(session_id)
+    registry.release(session_id)
+    return chat
+
+def test_session_registry_keeps_one_chat_per_session():
+    registry = make_registry()
+    assert use(registry, 'a') is use(registry, 'a')
+    assert use(registry, 'a') is not use(registry, 'b')
+
+def test_session_registry_serializes_requests_of_one_session():
+    registry = make_registry()
+    registry.get('a')
+    events = []
+    other = threading.Thread(target=lambda: events.append(use(registry, 'a')))
+    other.start()
+    other.join(0.1)
+    assert events == []
+    assert use(registry, 'b') is not None
+    registry.release('a')
+    other.join(1)
+    assert len(events) == 1
+
+def test_session_registry_trims_history_in_whole_turns():
+    registry = make_registry()
+    chat = registry.get('a')
+    for _ in range(5):
+        chat.send("hello")
+    chat._history.append(FakeContent("pending"))
+    registry.release('a')
+    assert len(chat._history) == 3
+    assert chat._history[-1].parts[0].text == "pending"
+
+def test_session_registry_evicts_least_recently_used():
+    registry = make_registry(max_sessions=2)
+    first = use(registry, 'a')
+    use(registry, 'b')
+    use(registry, 'a')
+    use(registry, 'c')
+    assert len(registry) == 2
+    assert use(registry, 'a') is first
+
+def test_session_registry_enforces_memory_cap():
+    registry = make_registry(max_bytes=15)
+    for session_id in ['a', 'b']:
+        registry.get(session_id).send("x" * 5)
+        registry.release(session_id)
+    assert len(registry) == 1
+    assert registry.total_bytes() == 10
+
+def test_session_registry_evicts_idle_sessions():
+    registry = make_registry(ttl=0)
+    first = use(registry, 'a')
+    assert use(registry, 'a') is not first
+
+def test_normalize_question_ignores_case_accents_and_punctuation():
+    assert normalize_question("¿Cuál es el precio  PROMEDIO?") == "cual es el precio promedio"
+
+def test_ttl_cache_counts_hits_and_misses():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get('q') is None
+    cache.set('q', 'SELECT 1')
+    assert cache.get('q') == 'SELECT 1'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0)
+    cache.set('a', 1)
+    time.sleep(0.01)
+    assert cache.get('a') is None
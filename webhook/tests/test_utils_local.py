@@ -0,0 +1,49 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+import pytest
+
+pytest.importorskip('duckdb')
+pytest.importorskip('pyarrow')
+
+from utils_local import LocalCatalog
+
+@pytest.fixture(scope='module')
+def catalog():
+    return LocalCatalog('catalog/products_catalog.csv', 'my-project', 'my_dataset', 'products')
+
+def test_local_catalog_runs_generated_sql(catalog):
+    table, total_rows = catalog.run_query("SELECT COUNT(*) AS total FROM `my-project.my_dataset.products`;", 100)
+    assert total_rows == 1
+    assert table.column('total')[0].as_py() == 4566
+
+def test_local_catalog_uses_typed_columns(catalog):
+    table, _ = catalog.run_query(
+        "SELECT MIN(SellPrice) AS cheapest FROM `my-project`.`my_dataset`.`products` "
+        "WHERE BrandName = 'clarins' AND Category = 'Fragrance-Women'", 100
+    )
+    assert table.column('cheapest')[0].as_py() > 0
+
+def test_local_catalog_caps_rows(catalog):
+    table, total_rows = catalog.run_query("SELECT * FROM `my-project.my_dataset.products`", 10)
+    assert table.num_rows == 10
+    assert total_rows == 4566
+
+def test_local_catalog_rejects_unknown_tables(catalog):
+    with pytest.raises(Exception):
+        catalog.run_query("SELECT * FROM `my-project.other_dataset.orders`", 100)
@@ -0,0 +1,66 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+
+import pytest
+
+from utils_metrics import Metrics, make_metrics
+
+class RecordingMetrics(Metrics):
+    def __init__(self):
+        super().__init__('test')
+        self.records = []
+
+    def record(self, stage, seconds, status, counts):
+        self.records.append((stage, status, counts))
+
+def test_span_records_counts_and_errors():
+    metrics = RecordingMetrics()
+    with metrics.span('answer_generation') as span:
+        span['tokens'] = 120
+    with pytest.raises(RuntimeError):
+        with metrics.span('bq_execution'):
+            raise RuntimeError('query failed')
+    assert metrics.records == [('answer_generation', 'ok', {'tokens': 120}), ('bq_execution', 'error', {})]
+
+def test_make_metrics_defaults_to_no_op():
+    metrics = make_metrics('none', 'test')
+    with metrics.span('schema_fetch') as span:
+        span['bytes'] = 10
+    with pytest.raises(ValueError):
+        make_metrics('statsd', 'test')
+
+def test_prometheus_metrics_exports_histograms():
+    prometheus_client = pytest.importorskip('prometheus_client')
+    metrics = make_metrics('prometheus', 'webhook_test', 0)
+    with metrics.span('sql_generation') as span:
+        span['tokens'] = 42
+    assert prometheus_client.REGISTRY.get_sample_value(
+        'webhook_test_stage_tokens_sum', {'stage': 'sql_generation'}) == 42
+    assert prometheus_client.REGISTRY.get_sample_value(
+        'webhook_test_stage_seconds_count', {'stage': 'sql_generation', 'status': 'ok'}) == 1
+
+def test_prometheus_metrics_fails_when_the_port_is_taken(monkeypatch):
+    pytest.importorskip('prometheus_client')
+    import socket
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    with socket.socket() as busy:
+        busy.bind(('0.0.0.0', 0))
+        busy.listen()
+        with pytest.raises(RuntimeError):
+            make_metrics('prometheus', 'webhook_busy', busy.getsockname()[1])
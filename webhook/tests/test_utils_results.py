@@ -0,0 +1,60 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from utils_results import render_results
+
+def test_render_results_returns_small_tables_in_full():
+    table = pa.table({'BrandName': ['clarins', 'dior'], 'SellPrice': [120, 95]})
+    text = render_results(table, 2, 2000, 20)
+    assert text.splitlines() == ['BrandName | SellPrice', 'clarins | 120', 'dior | 95']
+
+def test_render_results_summarizes_large_tables():
+    table = pa.table({'BrandName': [f'brand{i}' for i in range(500)], 'SellPrice': list(range(500))})
+    text = render_results(table, 5000, 200, 3)
+    assert text.startswith('5000 rows in total, showing the first 3:')
+    assert 'brand3 |' not in text
+    assert 'SellPrice: min 0, max 499, mean 249.50' in text
+    assert 'BrandName: 500 distinct values' in text
+
+def test_render_results_converts_nested_and_bytes_columns():
+    table = pa.table({
+        'Tags': pa.array([['a', 'b'], None]),
+        'Price': pa.array([{'amount': 10}, {'amount': 12}]),
+        'Hash': pa.array([b'\xff\x00', b'ab']),
+    })
+    text = render_results(table, 2, 2000, 20)
+    assert text.splitlines() == [
+        "Tags | Price | Hash",
+        "['a', 'b'] | {'amount': 10} | b'\\xff\\x00'",
+        " | {'amount': 12} | b'ab'",
+    ]
+
+def test_render_results_summarizes_nested_columns():
+    table = pa.table({'Tags': pa.array([['a'], ['b'], ['a']] * 100)})
+    text = render_results(table, 300, 50, 2)
+    assert 'Tags: 2 distinct values' in text
+
+def test_render_results_renders_empty_results():
+    table = pa.table({'BrandName': pa.array([], pa.string())})
+    assert render_results(table, 0, 2000, 20).splitlines() == ['BrandName', 'No rows.']
+    assert render_results(pa.table({}), 0, 2000, 20) == 'No rows.'
@@ -0,0 +1,109 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+import asyncio
+import threading
+import time
+import pytest
+from utils_retry import TokenBucket, RetryPolicy, PRIORITY_TEXT, PRIORITY_VIDEO
+
+class Throttled(Exception):
+    def __str__(self):
+        return "429 Resource exhausted"
+
+def flaky(failures):
+    calls = []
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise Throttled()
+        return "ok"
+    return func, calls
+
+def make_policy(max_attempts=3):
+    return RetryPolicy(TokenBucket(rate=1000, capacity=10), max_attempts=max_attempts,
+                       base_delay=0.001, max_delay=0.01)
+
+def test_retry_policy_retries_throttling_errors():
+    policy = make_policy()
+    func, calls = flaky(failures=2)
+    assert policy.call(func) == "ok"
+    assert len(calls) == 3
+    assert policy.metrics['retried'] == 2
+
+def test_retry_policy_gives_up_after_max_attempts():
+    policy = make_policy(max_attempts=2)
+    func, calls = flaky(failures=5)
+    with pytest.raises(Throttled):
+        policy.call(func)
+    assert len(calls) == 2
+    assert policy.metrics['failed'] == 1
+
+def test_retry_policy_does_not_retry_other_errors():
+    policy = make_policy()
+    def func():
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        policy.call(func)
+    assert policy.metrics['retried'] == 0
+
+def test_token_bucket_serves_higher_priority_first():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=1)
+        await bucket.acquire_async()
+        order = []
+        async def take(name, priority):
+            await bucket.acquire_async(priority)
+            order.append(name)
+        video = asyncio.create_task(take('video', PRIORITY_VIDEO))
+        await asyncio.sleep(0)
+        text = asyncio.create_task(take('text', PRIORITY_TEXT))
+        await asyncio.gather(video, text)
+        return order
+    assert asyncio.run(scenario()) == ['text', 'video']
+
+def test_token_bucket_serves_contended_threads_from_the_burst():
+    bucket = TokenBucket(rate=1, capacity=10)
+    # Every thread is queued before any of them tries to take a token
+    queued = threading.Barrier(8)
+    enqueue = bucket._enqueue
+    def enqueue_together(*args):
+        entry = enqueue(*args)
+        queued.wait()
+        return entry
+    bucket._enqueue = enqueue_together
+    waits = []
+    threads = [threading.Thread(target=lambda: waits.append(bucket.acquire())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(waits) == 8
+    assert max(waits) < 0.2
+
+def test_token_bucket_wakes_queued_threads_in_turn():
+    bucket = TokenBucket(rate=20, capacity=1)
+    bucket.acquire()
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    # One token every 50 ms, without the extra sleeps of callers behind the head
+    assert time.monotonic() - start < 0.4
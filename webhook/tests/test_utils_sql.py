@@ -0,0 +1,76 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+
+import pytest
+
+pytest.importorskip('sqlglot')
+
+from utils_sql import (
+    SqlValidationError, parse_schema_columns, validate_sql, rows_needed, extract_sql_query, sql_outcomes
+)
+
+COLUMNS = parse_schema_columns("- BrandName (STRING)\n- Category (STRING)\n- SellPrice (INT64)")
+
+def validate(sql):
+    return validate_sql(sql, COLUMNS, 'my-project', 'my_dataset', 'products')
+
+def test_parse_schema_columns():
+    assert COLUMNS == {'brandname', 'category', 'sellprice'}
+
+def test_validate_sql_accepts_queries_on_the_table():
+    sql = ("WITH brands AS (SELECT BrandName, MIN(SellPrice) AS cheapest FROM `my-project.my_dataset.products` "
+           "GROUP BY BrandName) SELECT BrandName, cheapest FROM brands ORDER BY cheapest LIMIT 5;")
+    assert validate(sql) == sql
+
+@pytest.mark.parametrize('sql', [
+    "I cannot answer that question.",
+    "DELETE FROM `my-project.my_dataset.products` WHERE TRUE",
+    "SELECT 1; SELECT 2",
+    "SELECT * FROM `my-project.my_dataset.orders`",
+    "SELECT Color FROM `my-project.my_dataset.products`",
+])
+def test_validate_sql_rejects_invalid_queries(sql):
+    with pytest.raises(SqlValidationError):
+        validate(sql)
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT BrandName FROM `my-project.my_dataset.products` ORDER BY SellPrice DESC LIMIT 5", 5),
+    ("SELECT AVG(SellPrice) AS average FROM `my-project.my_dataset.products`", 1),
+    ("SELECT Category, AVG(SellPrice) FROM `my-project.my_dataset.products` GROUP BY Category", 100),
+    ("SELECT BrandName, AVG(SellPrice) OVER () FROM `my-project.my_dataset.products`", 100),
+])
+def test_rows_needed(sql, expected):
+    assert rows_needed(sql, 100) == expected
+
+def test_extract_sql_query_reads_the_json_object():
+    response = '{"sql": " SELECT BrandName FROM products ", "answerable": true, "reason": ""}'
+    assert extract_sql_query(response) == {'sql': 'SELECT BrandName FROM products', 'answerable': True, 'reason': ''}
+
+def test_extract_sql_query_reads_unanswerable_questions():
+    response = '{"sql": "", "answerable": false, "reason": "The table has no stock levels."}'
+    assert extract_sql_query(response) == {'sql': '', 'answerable': False, 'reason': 'The table has no stock levels.'}
+
+@pytest.mark.parametrize('response, sql', [
+    ('["SELECT 1"]', '["SELECT 1"]'),
+    ('```sql\nSELECT BrandName FROM products\n```', 'SELECT BrandName FROM products'),
+])
+def test_extract_sql_query_falls_back_to_bare_sql(response, sql):
+    invalid = sql_outcomes['invalid_json']
+    assert extract_sql_query(response) == {'sql': sql, 'answerable': True, 'reason': ''}
+    assert sql_outcomes['invalid_json'] == invalid + 1
@@ -0,0 +1,42 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+
+from prompts import BQ_SQL_GENERATION_PROMPT
+from utils_tokens import compact_turns, RESULT_PLACEHOLDER
+
+def sql_turn(question):
+    return ('user', BQ_SQL_GENERATION_PROMPT.format(user_query=question))
+
+def result_turn(question):
+    return ('user', f"System:\n```\nBrandName | SellPrice\nclarins | 120\n```\nUser: {question}")
+
+def test_compact_turns_omits_old_results():
+    turns = [sql_turn('q1'), ('model', 'sql 1'), result_turn('q1'), ('model', 'a1'),
+             sql_turn('q2'), ('model', 'sql 2'), result_turn('q2'), ('model', 'a2')]
+    compacted, dropped = compact_turns(turns, 100000, 4)
+    assert dropped == 0
+    assert compacted[:2] == turns[:2]
+    assert RESULT_PLACEHOLDER in compacted[2][1] and 'clarins' not in compacted[2][1]
+    assert compacted[4:] == turns[4:]
+
+def test_compact_turns_drops_oldest_pairs_over_budget():
+    turns = [('user', 'x' * 400), ('model', 'y' * 400)] * 5
+    compacted, dropped = compact_turns(turns, 450, 4)
+    assert dropped == 6
+    assert compacted == turns[6:]
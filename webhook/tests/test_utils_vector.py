@@ -0,0 +1,62 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+sys.path.append('webhook/')
+import pytest
+
+pytest.importorskip('numpy')
+
+from utils_vector import HashingEmbedder, VectorIndex
+
+DOCUMENTS = {
+    'attention.pdf': [
+        {'source': 'attention.pdf', 'page': 1, 'text': 'The Transformer relies entirely on attention mechanisms'},
+        {'source': 'attention.pdf', 'page': 2, 'text': 'Multi-head attention projects queries keys and values'},
+    ],
+    'bert.pdf': [
+        {'source': 'bert.pdf', 'page': 1, 'text': 'BERT is pre-trained with masked language modeling'},
+    ],
+}
+
+def build(index_dir, digests, loaded=None):
+    index = VectorIndex(str(index_dir), HashingEmbedder())
+    def load_chunks(name):
+        if loaded is not None:
+            loaded.append(name)
+        return DOCUMENTS[name]
+    index.update(digests, load_chunks)
+    return index
+
+def test_vector_index_returns_most_similar_chunks(tmp_path):
+    index = build(tmp_path, {'attention.pdf': 'a1', 'bert.pdf': 'b1'})
+    results = index.search('masked language modeling', k=2)
+    assert results[0]['source'] == 'bert.pdf'
+    assert results[0]['score'] >= results[1]['score']
+
+def test_vector_index_only_embeds_new_documents(tmp_path):
+    build(tmp_path, {'attention.pdf': 'a1'})
+    loaded = []
+    index = build(tmp_path, {'attention.pdf': 'a1', 'bert.pdf': 'b1'}, loaded)
+    assert loaded == ['bert.pdf']
+    assert index.manifest['rows'] == 3
+    assert index.search('masked language', k=1)[0]['source'] == 'bert.pdf'
+
+def test_vector_index_drops_removed_documents(tmp_path):
+    build(tmp_path, {'attention.pdf': 'a1', 'bert.pdf': 'b1'})
+    index = build(tmp_path, {'bert.pdf': 'b1'})
+    assert index.manifest['rows'] == 1
+    assert [chunk['source'] for chunk in index.search('attention', k=5)] == ['bert.pdf']
@@ -14,15 +14,71 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextvars
+import logging
+import os
+import threading
+import time
 import pandas as pd
-from configs import BQ_DATASET, BQ_TABLE, PROJECT_ID, LOCATION_ID
+import pyarrow as pa
+from configs import (
+    BQ_DATASET, BQ_TABLE, PROJECT_ID, LOCATION_ID, MODEL,
+    GEMINI_REQUESTS_PER_MINUTE, GEMINI_BURST, GEMINI_MAX_ATTEMPTS,
+    CHAT_TOKEN_BUDGET, CHAT_KEEP_RECENT, BQ_JOBLESS_QUERIES, BQ_PAGE_SIZE,
+    METRICS_EXPORTER, METRICS_PORT
+)
 from google.cloud import bigquery
 import vertexai
-from vertexai.generative_models import GenerativeModel, ChatSession
+from vertexai.generative_models import GenerativeModel, ChatSession, GenerationConfig, Content, Part
+from utils_retry import TokenBucket, RetryPolicy, PRIORITY_TEXT
+from utils_tokens import compact_turns, estimate_tokens
+from utils_metrics import make_metrics
+from prompts import BQ_SQL_SYSTEM_INSTRUCTION
+
+# One-off setup timings in milliseconds, paid once per worker instead of per request
+SETUP_TIMINGS = {}
 
 # Initialize Vertex AI
+_start = time.perf_counter()
 vertexai.init(project=PROJECT_ID, location=LOCATION_ID)
+SETUP_TIMINGS['vertexai_init_ms'] = (time.perf_counter() - _start) * 1000
+# Short queries go through jobs.query without creating a job; still a preview
+# flag in this client version, read by query_and_wait on every call
+os.environ.setdefault('QUERY_PREVIEW_ENABLED', 'true' if BQ_JOBLESS_QUERIES else 'false')
+_start = time.perf_counter()
 client = bigquery.Client(project=PROJECT_ID)
+SETUP_TIMINGS['bigquery_client_ms'] = (time.perf_counter() - _start) * 1000
+
+# Rate limiting and retries for Gemini calls, sized to this service's share of the Vertex AI quota
+gemini_retry = RetryPolicy(
+    TokenBucket(rate=GEMINI_REQUESTS_PER_MINUTE / 60, capacity=GEMINI_BURST),
+    max_attempts=GEMINI_MAX_ATTEMPTS,
+)
+
+# Per-stage latency, token and byte histograms of the webhook
+metrics = make_metrics(METRICS_EXPORTER, 'webhook', METRICS_PORT)
+
+# Constrained JSON output for SQL generation
+SQL_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sql": {"type": "string", "description": "The BigQuery SQL query, empty if the question is not answerable."},
+        "answerable": {"type": "boolean", "description": "Whether the table has the information to answer the question."},
+        "reason": {"type": "string", "description": "Why the question cannot be answered, empty otherwise."},
+    },
+    "required": ["sql", "answerable", "reason"],
+}
+sql_generation_config = GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=SQL_RESPONSE_SCHEMA,
+)
+
+# Token usage of the Gemini calls made while handling the current request
+request_usage = contextvars.ContextVar('request_usage', default=None)
+
+# Shared GenerativeModels, built lazily once per worker and keyed by column block
+_models = {}
+_model_lock = threading.Lock()
 
 
 def run_query(sql: str) -> pd.DataFrame:
@@ -39,19 +95,248 @@ def run_query(sql: str) -> pd.DataFrame:
         result_query = client.query(sql)
         result_query.result()
     except Exception as e:
-        print("Error running the query: {}".format(e))
+        logging.error("Error running the query: {}".format(e))
         return None
     return result_query.to_dataframe()
 
-def get_chat_response(chat: ChatSession, prompt: str) -> str:
+def dry_run_query(sql: str) -> int:
+    """Validates a SQL query with a BigQuery dry run, without running it.
+
+    Args:
+        sql (str): The SQL query string to validate.
+
+    Returns:
+        int: The number of bytes the query would process.
+
+    Raises:
+        Exception: If BigQuery rejects the query.
+    """
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    return client.query(sql, job_config=job_config).total_bytes_processed
+
+def run_query_arrow(sql: str, max_rows: int, max_bytes_billed: int = None):
+    """Executes a SQL query and fetches at most `max_rows` rows as Arrow record batches.
+
+    Args:
+        sql (str): The SQL query string to execute.
+        max_rows (int): Maximum number of rows fetched.
+        max_bytes_billed (int): BigQuery fails the query instead of billing more bytes than this.
+
+    Returns:
+        tuple: The fetched rows as a `pyarrow.Table` and the total number of
+               rows of the result.
+
+    Raises:
+        Exception: If the query fails, e.g. over `max_bytes_billed`.
+    """
+    batches = []
+    fetched = 0
+    total_rows = 0
+    for batch, total_rows in stream_query_arrow(sql, max_rows, max_bytes_billed):
+        batches.append(batch)
+        fetched += batch.num_rows
+        if fetched >= max_rows:
+            break
+    table = pa.Table.from_batches(batches).slice(0, max_rows) if batches else pa.table({})
+    return table, total_rows
+
+def stream_query_arrow(sql: str, max_rows: int, max_bytes_billed: int = None):
+    """Runs a SQL query and yields its rows as Arrow record batches, one per page.
+
+    Uses `query_and_wait`, so short queries return their first page in the
+    same call that runs them, and later pages are only fetched when the
+    caller asks for them.
+
+    Args:
+        sql (str): The SQL query string to execute.
+        max_rows (int): Maximum number of rows fetched.
+        max_bytes_billed (int): BigQuery fails the query instead of billing more bytes than this.
+
+    Yields:
+        tuple: A `pyarrow.RecordBatch` and the total number of rows of the result.
+
+    Raises:
+        Exception: If the query fails.
+    """
+    job_config = bigquery.QueryJobConfig(maximum_bytes_billed=max_bytes_billed)
+    rows = client.query_and_wait(sql, job_config=job_config, max_results=max_rows, page_size=BQ_PAGE_SIZE)
+    for batch in rows.to_arrow_iterable():
+        yield batch, rows.total_rows
+
+def get_table_last_modified(table_id: str):
+    """Returns the last modification time of a BigQuery table.
+
+    This is a metadata lookup and does not start a query job.
+
+    Args:
+        table_id (str): The table reference as `project.dataset.table`.
+
+    Returns:
+        datetime: The table's `last_modified_time`.
+                  None if the table metadata cannot be fetched.
+    """
+    try:
+        return client.get_table(table_id).modified
+    except Exception as e:
+        logging.error("Error fetching table metadata: {}".format(e))
+        return None
+
+def get_model(s_columns: str = None) -> GenerativeModel:
+    """Returns the worker-wide GenerativeModel for a column block, building it on first use.
+
+    The model holds no per-conversation state, so a single instance is shared
+    by all requests and threads; chat history lives in each ChatSession.
+    The static SQL instructions and the column block are the model's system
+    instruction, so they are not re-sent with every question, and a new model
+    is built when the schema cache returns a different column block.
+
+    Args:
+        s_columns (str): The formatted column block, or None for a model
+                         without system instruction.
+
+    Returns:
+        GenerativeModel: The shared model instance.
+    """
+    model = _models.get(s_columns)
+    if model is None:
+        with _model_lock:
+            model = _models.get(s_columns)
+            if model is None:
+                start = time.perf_counter()
+                system_instruction = None
+                if s_columns is not None:
+                    system_instruction = BQ_SQL_SYSTEM_INSTRUCTION.format(
+                        project_id=PROJECT_ID, dataset=BQ_DATASET, table=BQ_TABLE, columns=s_columns)
+                model = GenerativeModel(MODEL, system_instruction=system_instruction)
+                # Only the model of the latest column block is kept
+                for key in [key for key in _models if key is not None]:
+                    del _models[key]
+                _models[s_columns] = model
+                SETUP_TIMINGS['model_build_ms'] = (time.perf_counter() - start) * 1000
+    return model
+
+def start_sql_chat(s_columns: str, history: list = None) -> ChatSession:
+    """Starts a chat for SQL generation on the model of a column block.
+
+    The chat is seeded with a copy of the session's history, so follow-up
+    questions keep their context, while the session chat itself stays on the
+    model without system instruction and never sees the SQL turns.
+
+    Args:
+        s_columns (str): The formatted column block.
+        history (list): The history of the session chat.
+
+    Returns:
+        ChatSession: A new chat session, used for the generation and repairs of one query.
+    """
+    return get_model(s_columns).start_chat(history=list(history or []))
+
+def warm_up(ping: bool = True, s_columns: str = None):
+    """Builds the shared model at cold start and optionally opens its connection.
+
+    Args:
+        ping (bool): If True, sends a `count_tokens` call so the gRPC channel and
+                     auth token are ready before the first user request.
+        s_columns (str): The column block of the model to build, if already loaded.
+    """
+    # Session chats use the model without system instruction, SQL chats the one of the column block
+    get_model()
+    model = get_model(s_columns)
+    if ping:
+        start = time.perf_counter()
+        try:
+            model.count_tokens("warm up")
+        except Exception as e:
+            logging.warning(f"Model warm-up call failed: {e}")
+        SETUP_TIMINGS['model_warmup_ms'] = (time.perf_counter() - start) * 1000
+    logging.info("Setup timings paid once per worker: " + ", ".join(
+        f"{name}={ms:.1f}" for name, ms in SETUP_TIMINGS.items()))
+
+def get_chat_response(chat: ChatSession, prompt: str, generation_config: GenerationConfig = None,
+                      stage: str = 'answer_generation') -> str:
     """Sends a prompt to a chat session and returns the text response.
 
+    Calls go through the shared Gemini rate limiter and are retried with
+    jittered backoff on throttling errors.
+
+    Args:
+        chat (ChatSession): An active chat session object.
+        prompt (str): The message or query to send to the chat session.
+        generation_config (GenerationConfig): Optional config for this message,
+            e.g. `sql_generation_config` for JSON output.
+        stage (str): Stage name under which the call is timed.
+
+    Returns:
+        str: The text response from the chat session.
+    """
+    with metrics.span(stage) as span:
+        history_tokens = compact_chat(chat)
+        response = gemini_retry.call(chat.send_message, prompt, generation_config=generation_config, priority=PRIORITY_TEXT)
+        span['tokens'] = record_usage(response, history_tokens, prompt)
+    return response.text
+
+async def get_chat_response_async(chat: ChatSession, prompt: str, generation_config: GenerationConfig = None,
+                                  stage: str = 'answer_generation') -> str:
+    """Async version of `get_chat_response`, for the ASGI server.
+
     Args:
         chat (ChatSession): An active chat session object.
         prompt (str): The message or query to send to the chat session.
+        generation_config (GenerationConfig): Optional config for this message.
+        stage (str): Stage name under which the call is timed.
 
     Returns:
         str: The text response from the chat session.
     """
-    response = chat.send_message(prompt)
-    return response.text
\ No newline at end of file
+    with metrics.span(stage) as span:
+        history_tokens = compact_chat(chat)
+        response = await gemini_retry.call_async(
+            chat.send_message_async, prompt, generation_config=generation_config, priority=PRIORITY_TEXT)
+        span['tokens'] = record_usage(response, history_tokens, prompt)
+    return response.text
+
+def record_usage(response, history_tokens: int, prompt: str) -> int:
+    """Adds the token usage of a Gemini call to the counters of the current request, if any.
+
+    Returns:
+        int: The prompt and response tokens reported by Gemini.
+    """
+    usage = request_usage.get()
+    if usage is not None:
+        usage['calls'] += 1
+        usage['history_tokens'] += history_tokens
+        usage['message_tokens'] += estimate_tokens(prompt)
+        usage['prompt_tokens'] += response.usage_metadata.prompt_token_count
+        usage['response_tokens'] += response.usage_metadata.candidates_token_count
+    return response.usage_metadata.prompt_token_count + response.usage_metadata.candidates_token_count
+
+def compact_chat(chat: ChatSession) -> int:
+    """Compacts a chat history in place so it stays within CHAT_TOKEN_BUDGET.
+
+    Args:
+        chat (ChatSession): The chat session about to be sent a message.
+
+    Returns:
+        int: The estimated tokens of the compacted history.
+    """
+    history = chat._history
+    turns = [(content.role, "".join(part.text for part in content.parts)) for content in history]
+    compacted, dropped = compact_turns(turns, CHAT_TOKEN_BUDGET, CHAT_KEEP_RECENT)
+    if dropped or compacted != turns[dropped:]:
+        history[:] = [
+            content if (role, text) == turns[i + dropped] else Content(role=role, parts=[Part.from_text(text)])
+            for i, (content, (role, text)) in enumerate(zip(history[dropped:], compacted))
+        ]
+    return sum(estimate_tokens(text) for _, text in compacted)
+
+def start_request_usage() -> dict:
+    """Starts counting the token usage of the Gemini calls of the current request.
+
+    Returns:
+        dict: The counters, filled in by `get_chat_response`: calls, estimated
+              history and message tokens, and the prompt and response tokens
+              reported by Gemini.
+    """
+    usage = {'calls': 0, 'history_tokens': 0, 'message_tokens': 0, 'prompt_tokens': 0, 'response_tokens': 0}
+    request_usage.set(usage)
+    return usage
\ No newline at end of file
@@ -0,0 +1,348 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import pickle
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+class SchemaCache:
+    """Process-level cache for a value derived from a BigQuery table schema.
+
+    The value is loaded on first use and served from memory afterwards. Once
+    it is older than ``ttl`` seconds the next caller still gets the cached
+    value, while a background thread compares the table version (for example
+    its ``last_modified_time``) and reloads the value only if it changed.
+
+    Args:
+        loader: Callable that builds the value. Returning None means the load
+            failed and it will be retried on the next call.
+        version_fn: Callable returning the current table version, or None if
+            it cannot be determined (forces a reload).
+        ttl: Seconds before the cached value is revalidated.
+    """
+
+    def __init__(self, loader: Callable[[], Any],
+                 version_fn: Callable[[], Any], ttl: float):
+        self.loader = loader
+        self.version_fn = version_fn
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+
+    def get(self) -> Optional[Any]:
+        """Returns the cached value, loading it synchronously on first use."""
+        with self._lock:
+            if self._value is None:
+                self._load()
+                return self._value
+            if self._is_expired() and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+            return self._value
+
+    def invalidate(self):
+        """Drops the cached value so the next call reloads it."""
+        with self._lock:
+            self._value = None
+            self._version = None
+
+    def _is_expired(self) -> bool:
+        return time.monotonic() - self._loaded_at >= self.ttl
+
+    def _load(self):
+        version = self.version_fn()
+        value = self.loader()
+        if value is not None:
+            self._value = value
+            self._version = version
+            self._loaded_at = time.monotonic()
+
+    def _refresh(self):
+        try:
+            version = self.version_fn()
+            if version is not None and version == self._version:
+                logging.info("Schema unchanged, extending cache lifetime.")
+                with self._lock:
+                    self._loaded_at = time.monotonic()
+                return
+            logging.info("Schema version changed, reloading cache.")
+            value = self.loader()
+            if value is not None:
+                with self._lock:
+                    self._value = value
+                    self._version = version
+                    self._loaded_at = time.monotonic()
+        except Exception as e:
+            logging.error(f"Error refreshing schema cache: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+class SessionRegistry:
+    """Bounded, thread-safe registry of ChatSession objects keyed by session ID.
+
+    Sessions idle for longer than ``ttl`` seconds are dropped, the least
+    recently used sessions are evicted once there are more than
+    ``max_sessions`` or their combined history exceeds ``max_bytes``, and each
+    session's history is trimmed to its last ``max_history`` messages.
+
+    A session is locked from `get` until `release`, so overlapping requests
+    for one session take turns instead of sharing its chat while history is
+    trimmed or compacted. Each `get` must be followed by a `release`, which
+    may come from another thread.
+
+    Args:
+        factory: Callable that creates a new ChatSession.
+        max_sessions: Maximum number of sessions kept in memory.
+        ttl: Seconds a session may stay idle before it is evicted.
+        max_history: Maximum number of messages kept per session.
+        max_bytes: Approximate cap on the text held by all histories.
+    """
+
+    def __init__(self, factory: Callable[[], Any], max_sessions: int,
+                 ttl: float, max_history: int, max_bytes: int):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_history = max_history
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> [chat, last_used, size]
+        self._session_locks = {}  # session_id -> [lock, holders and waiters]
+
+    def get(self, session_id: str) -> Any:
+        """Locks a session and returns its chat, creating it if needed."""
+        with self._lock:
+            session_lock = self._session_locks.setdefault(session_id, [threading.Lock(), 0])
+            session_lock[1] += 1
+        session_lock[0].acquire()
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = [self.factory(), now, 0]
+                self._sessions[session_id] = entry
+            else:
+                entry[1] = now
+                self._sessions.move_to_end(session_id)
+            self._evict_overflow(keep=session_id)
+            return entry[0]
+
+    def release(self, session_id: str):
+        """Trims a session's history after a turn, enforces the memory cap and unlocks the session."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                trim_history(entry[0], self.max_history)
+                entry[2] = history_size(entry[0])
+                self._evict_overflow(keep=session_id)
+            session_lock = self._session_locks[session_id]
+            session_lock[1] -= 1
+            if not session_lock[1]:
+                del self._session_locks[session_id]
+        session_lock[0].release()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def total_bytes(self) -> int:
+        return sum(entry[2] for entry in self._sessions.values())
+
+    def _evict_expired(self, now: float):
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry[1] < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            logging.info(f"Evicted idle chat session {session_id}")
+
+    def _evict_overflow(self, keep: str):
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self.total_bytes() > self.max_bytes):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._sessions.popitem(last=False)
+            logging.info(f"Evicted least recently used chat session {session_id}")
+
+
+def trim_history(chat: Any, max_history: int):
+    """Keeps only the last ``max_history`` messages of a chat, in whole turns."""
+    history = chat._history
+    if len(history) > max_history:
+        # Drop an even number of messages so the history still starts with a user turn
+        drop = len(history) - max_history
+        drop += drop % 2
+        del history[:drop]
+
+
+def history_size(chat: Any) -> int:
+    """Approximates the memory held by a chat history as its text length."""
+    size = 0
+    for content in chat._history:
+        for part in content.parts:
+            try:
+                size += len(part.text)
+            except (AttributeError, ValueError):
+                pass
+    return size
+
+
+def normalize_question(text: str) -> str:
+    """Normalizes a user question so trivially different phrasings share a key.
+
+    Lowercases, strips accents and punctuation, and collapses whitespace, so
+    "¿Cuál es el precio promedio?" and "cual es el precio promedio" match.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def hash_text(text: str) -> str:
+    """Returns a short, stable digest of a text, used to build cache keys."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds.
+
+    Args:
+        maxsize: Maximum number of entries kept.
+        ttl: Seconds an entry stays valid.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+class RedisCache:
+    """Cache backed by a Redis-compatible server, shared between workers.
+
+    Values are pickled and stored with a TTL. A sorted set of insertion times
+    keeps the number of entries under ``maxsize`` by dropping the oldest ones.
+
+    Args:
+        url: Redis connection URL, e.g. `redis://localhost:6379/0`.
+        name: Namespace prefix for the keys of this cache.
+        maxsize: Maximum number of entries kept.
+        ttl: Seconds an entry stays valid.
+    """
+
+    def __init__(self, url: str, name: str, maxsize: int, ttl: float):
+        import redis
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._prefix = f"{name}:"
+        self._index = f"{name}:__index__"
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            data = self._redis.get(self._prefix + hash_text(key))
+        except Exception as e:
+            logging.warning(f"Redis cache unavailable: {e}")
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key: str, value: Any):
+        redis_key = self._prefix + hash_text(key)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.set(redis_key, pickle.dumps(value), ex=int(self.ttl))
+            pipe.zadd(self._index, {redis_key: time.time()})
+            pipe.execute()
+            overflow = self._redis.zcard(self._index) - self.maxsize
+            if overflow > 0:
+                oldest = [member for member, _ in self._redis.zpopmin(self._index, overflow)]
+                self._redis.delete(*oldest)
+        except Exception as e:
+            logging.warning(f"Redis cache unavailable: {e}")
+
+    def stats(self) -> dict:
+        try:
+            size = self._redis.zcard(self._index)
+        except Exception:
+            size = None
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+
+def make_cache(backend: str, name: str, maxsize: int, ttl: float, redis_url: str = None):
+    """Builds a cache for the configured backend.
+
+    Args:
+        backend: 'memory' for an in-process cache or 'redis' for a shared one.
+        name: Name of the cache, used as the Redis key prefix.
+        maxsize: Maximum number of entries kept.
+        ttl: Seconds an entry stays valid.
+        redis_url: Redis connection URL, required for the 'redis' backend.
+
+    Returns:
+        A TTLCache or RedisCache.
+    """
+    if backend == 'redis':
+        return RedisCache(redis_url, name, maxsize, ttl)
+    if backend != 'memory':
+        raise ValueError(f"Unknown cache backend: {backend}")
+    return TTLCache(maxsize, ttl)
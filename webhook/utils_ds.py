@@ -14,70 +14,164 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
 from typing import List
 from google.cloud import discoveryengine_v1alpha as discoveryengine
 from google.api_core.client_options import ClientOptions
 from configs import *
+from utils_cache import TTLCache, normalize_question
 
-def search_sample(
-        project_id: str,
-        location: str,
-        data_store_id: str,
-        search_query: str,
-    ) -> List[discoveryengine.SearchResponse]:
+# Long-lived search clients keyed by location
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+# Summary responses keyed by data store, mode and normalized query
+search_cache = TTLCache(DS_CACHE_MAXSIZE, DS_CACHE_TTL)
+
+# Optional: Configuration options for search
+# Refer to the `ContentSearchSpec` reference for all supported fields:
+# https://cloud.google.com/python/docs/reference/discoveryengine/latest/google.cloud.discoveryengine_v1.types.SearchRequest.ContentSearchSpec
+CONTENT_SEARCH_SPEC = discoveryengine.SearchRequest.ContentSearchSpec(
+    # For information about snippets, refer to:
+    # https://cloud.google.com/generative-ai-app-builder/docs/snippets
+    snippet_spec=discoveryengine.SearchRequest.ContentSearchSpec.SnippetSpec(
+        return_snippet=True
+    ),
+    # For information about search summaries, refer to:
+    # https://cloud.google.com/generative-ai-app-builder/docs/get-search-summaries
+    summary_spec=discoveryengine.SearchRequest.ContentSearchSpec.SummarySpec(
+        summary_result_count=5,
+        include_citations=True,
+        ignore_adversarial_query=True,
+        ignore_non_summary_seeking_query=True,
+    ),
+)
+
+# Fast mode: no snippets and a summary over fewer results, for latency-sensitive callers
+FAST_CONTENT_SEARCH_SPEC = discoveryengine.SearchRequest.ContentSearchSpec(
+    summary_spec=discoveryengine.SearchRequest.ContentSearchSpec.SummarySpec(
+        summary_result_count=DS_FAST_PAGE_SIZE,
+        include_citations=False,
+        ignore_adversarial_query=True,
+        ignore_non_summary_seeking_query=True,
+    ),
+)
+
+QUERY_EXPANSION_SPEC = discoveryengine.SearchRequest.QueryExpansionSpec(
+    condition=discoveryengine.SearchRequest.QueryExpansionSpec.Condition.AUTO,
+)
+
+SPELL_CORRECTION_SPEC = discoveryengine.SearchRequest.SpellCorrectionSpec(
+    mode=discoveryengine.SearchRequest.SpellCorrectionSpec.Mode.AUTO
+)
+
+def get_search_client(location: str) -> discoveryengine.SearchServiceClient:
+    """Returns the search client for a location, creating it on first use.
+
+    Args:
+        location (str): The data store location, e.g. `global` or `us`.
+
+    Returns:
+        discoveryengine.SearchServiceClient: The shared client.
+    """
+    with _clients_lock:
+        client = _clients.get(location)
+        if client is None:
+            client = discoveryengine.SearchServiceClient(client_options=get_client_options(location))
+            _clients[location] = client
+        return client
+
+def get_async_search_client(location: str) -> discoveryengine.SearchServiceAsyncClient:
+    """Returns the async search client for a location, creating it on first use.
+
+    The client is bound to the event loop it is first used from, the one of
+    the ASGI server.
+
+    Args:
+        location (str): The data store location, e.g. `global` or `us`.
+
+    Returns:
+        discoveryengine.SearchServiceAsyncClient: The shared client.
+    """
+    with _clients_lock:
+        client = _async_clients.get(location)
+        if client is None:
+            client = discoveryengine.SearchServiceAsyncClient(client_options=get_client_options(location))
+            _async_clients[location] = client
+        return client
+
+def get_client_options(location: str) -> ClientOptions:
+    """Returns the client options for the endpoint of a location."""
     #  For more information, refer to:
     # https://cloud.google.com/generative-ai-app-builder/docs/locations#specify_a_multi-region_for_your_data_store
-    client_options = (
+    return (
         ClientOptions(api_endpoint=f"{location}-discoveryengine.googleapis.com")
         if location != "global"
         else None
     )
 
-    # Create a client
-    client = discoveryengine.SearchServiceClient(client_options=client_options)
+def search_sample(
+        project_id: str,
+        location: str,
+        data_store_id: str,
+        search_query: str,
+        fast: bool = False,
+    ) -> List[discoveryengine.SearchResponse]:
+    cache_key = f"{project_id}/{location}/{data_store_id}/{fast}/{normalize_question(search_query)}"
+    response = search_cache.get(cache_key)
+    if response is not None:
+        return response
+
+    client = get_search_client(location)
+    request = build_search_request(project_id, location, data_store_id, search_query, fast)
+
+    response = client.search(request)
+    search_cache.set(cache_key, response)
+    return response
+
+async def search_sample_async(
+        project_id: str,
+        location: str,
+        data_store_id: str,
+        search_query: str,
+        fast: bool = False,
+    ) -> List[discoveryengine.SearchResponse]:
+    cache_key = f"{project_id}/{location}/{data_store_id}/{fast}/{normalize_question(search_query)}"
+    response = search_cache.get(cache_key)
+    if response is not None:
+        return response
 
+    client = get_async_search_client(location)
+    request = build_search_request(project_id, location, data_store_id, search_query, fast)
+
+    response = await client.search(request)
+    search_cache.set(cache_key, response)
+    return response
+
+def build_search_request(
+        project_id: str,
+        location: str,
+        data_store_id: str,
+        search_query: str,
+        fast: bool = False,
+    ) -> discoveryengine.SearchRequest:
     # The full resource name of the search engine serving config
     # e.g. projects/{project_id}/locations/{location}/dataStores/{data_store_id}/servingConfigs/{serving_config_id}
-    serving_config = client.serving_config_path(
+    serving_config = discoveryengine.SearchServiceClient.serving_config_path(
         project=project_id,
         location=location,
         data_store=data_store_id,
         serving_config="default_config",
     )
 
-    # Optional: Configuration options for search
-    # Refer to the `ContentSearchSpec` reference for all supported fields:
-    # https://cloud.google.com/python/docs/reference/discoveryengine/latest/google.cloud.discoveryengine_v1.types.SearchRequest.ContentSearchSpec
-    content_search_spec = discoveryengine.SearchRequest.ContentSearchSpec(
-        # For information about snippets, refer to:
-        # https://cloud.google.com/generative-ai-app-builder/docs/snippets
-        snippet_spec=discoveryengine.SearchRequest.ContentSearchSpec.SnippetSpec(
-            return_snippet=True
-        ),
-        # For information about search summaries, refer to:
-        # https://cloud.google.com/generative-ai-app-builder/docs/get-search-summaries
-        summary_spec=discoveryengine.SearchRequest.ContentSearchSpec.SummarySpec(
-            summary_result_count=5,
-            include_citations=True,
-            ignore_adversarial_query=True,
-            ignore_non_summary_seeking_query=True,
-        ),
-    )
-
     # Refer to the `SearchRequest` reference for all supported fields:
     # https://cloud.google.com/python/docs/reference/discoveryengine/latest/google.cloud.discoveryengine_v1.types.SearchRequest
-    request = discoveryengine.SearchRequest(
+    return discoveryengine.SearchRequest(
         serving_config=serving_config,
         query=search_query,
-        page_size=10,
-        content_search_spec=content_search_spec,
-        query_expansion_spec=discoveryengine.SearchRequest.QueryExpansionSpec(
-            condition=discoveryengine.SearchRequest.QueryExpansionSpec.Condition.AUTO,
-        ),
-        spell_correction_spec=discoveryengine.SearchRequest.SpellCorrectionSpec(
-            mode=discoveryengine.SearchRequest.SpellCorrectionSpec.Mode.AUTO
-        ),
-    )
-
-    response = client.search(request)
-    return response
\ No newline at end of file
+        page_size=DS_FAST_PAGE_SIZE if fast else 10,
+        content_search_spec=FAST_CONTENT_SEARCH_SPEC if fast else CONTENT_SEARCH_SPEC,
+        query_expansion_spec=QUERY_EXPANSION_SPEC,
+        spell_correction_spec=SPELL_CORRECTION_SPEC,
+    )
\ No newline at end of file
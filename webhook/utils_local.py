@@ -0,0 +1,104 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import re
+import threading
+import time
+
+# Column types of catalog/products_catalog.csv, matching the schema BigQuery infers
+CATALOG_COLUMNS = {
+    'S_No': 'BIGINT',
+    'BrandName': 'VARCHAR',
+    'Product_ID': 'VARCHAR',
+    'Product_Name': 'VARCHAR',
+    'Brand_Desc': 'VARCHAR',
+    'Product_Size': 'VARCHAR',
+    'Currancy': 'VARCHAR',
+    'MRP': 'VARCHAR',
+    'SellPrice': 'BIGINT',
+    'Discount': 'VARCHAR',
+    'Category': 'VARCHAR',
+}
+
+# Columns that get an index, since most questions filter on them
+INDEXED_COLUMNS = ['BrandName', 'Category']
+
+LOCAL_TABLE = 'catalog'
+
+
+class LocalCatalog:
+    """In-memory columnar copy of the products catalog queried with DuckDB.
+
+    The CSV is loaded once into typed columns with indexes on the most
+    filtered columns. Generated BigQuery SQL is run locally after rewriting
+    the fully qualified table name; queries DuckDB cannot run raise, so the
+    caller can fall back to BigQuery.
+
+    Args:
+        csv_path (str): Path to `products_catalog.csv`.
+        project_id (str): BigQuery project referenced by the generated SQL.
+        dataset (str): BigQuery dataset referenced by the generated SQL.
+        table (str): BigQuery table referenced by the generated SQL.
+    """
+
+    def __init__(self, csv_path: str, project_id: str, dataset: str, table: str):
+        import duckdb
+
+        start = time.perf_counter()
+        self._con = duckdb.connect(':memory:')
+        columns = ', '.join(f"'{name}': '{dtype}'" for name, dtype in CATALOG_COLUMNS.items())
+        self._con.execute(
+            f"CREATE TABLE {LOCAL_TABLE} AS "
+            f"SELECT * FROM read_csv('{csv_path}', header=true, columns={{{columns}}})"
+        )
+        for column in INDEXED_COLUMNS:
+            self._con.execute(f"CREATE INDEX idx_{column.lower()} ON {LOCAL_TABLE} ({column})")
+        self._lock = threading.Lock()
+        self._table_pattern = re.compile(
+            r"`?(?:`?{}`?\.)?`?{}`?\.`?{}`?".format(
+                re.escape(project_id), re.escape(dataset), re.escape(table)),
+            re.IGNORECASE,
+        )
+        logging.info(f"Loaded local catalog in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def translate(self, sql: str) -> str:
+        """Rewrites BigQuery table references and identifier quoting for DuckDB."""
+        sql = self._table_pattern.sub(LOCAL_TABLE, sql)
+        return sql.replace('`', '"').rstrip().rstrip(';')
+
+    def run_query(self, sql: str, max_rows: int):
+        """Executes a generated BigQuery SQL query against the local catalog.
+
+        Args:
+            sql (str): The SQL query string to execute.
+            max_rows (int): Maximum number of rows returned.
+
+        Returns:
+            tuple: At most `max_rows` rows as a `pyarrow.Table` and the total
+                   number of rows of the result.
+
+        Raises:
+            Exception: If the query cannot be run locally.
+        """
+        local_sql = self.translate(sql)
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            table = cursor.execute(local_sql).fetch_arrow_table()
+        finally:
+            cursor.close()
+        return table.slice(0, max_rows), table.num_rows
@@ -0,0 +1,169 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+# Histogram buckets: seconds, from cache hits to long multimodal generations,
+# and sizes for token and byte counts
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+class Metrics:
+    """Per-stage latency, token and byte histograms, with a no-op exporter.
+
+    Stages are timed with ``span``; subclasses export each observation.
+
+    Args:
+        service: Name of the service, used as the metric name prefix.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+
+    @contextmanager
+    def span(self, stage: str):
+        """Times a stage of a request.
+
+        Yields a dict where the stage can set its ``tokens`` and ``bytes``
+        counts; the stage is recorded with status ``error`` if it raises.
+        """
+        counts = {}
+        status = 'ok'
+        start = time.perf_counter()
+        try:
+            yield counts
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, status, counts)
+
+    def record(self, stage: str, seconds: float, status: str, counts: dict):
+        """Exports one stage observation. Does nothing in the default exporter."""
+
+
+class PrometheusMetrics(Metrics):
+    """Exports histograms on a local Prometheus endpoint at ``/metrics``.
+
+    With several worker processes (gunicorn, uvicorn --workers), set
+    ``PROMETHEUS_MULTIPROC_DIR`` to an empty directory shared by the workers:
+    each one writes its samples there and the endpoint, served by whichever
+    worker binds the port first, aggregates them all. Without it, a second
+    worker fails at startup instead of silently dropping its samples.
+
+    Args:
+        service: Name of the service, used as the metric name prefix.
+        port: Port of the metrics endpoint.
+    """
+
+    def __init__(self, service: str, port: int):
+        import prometheus_client
+        super().__init__(service)
+        self._latency = prometheus_client.Histogram(
+            f'{service}_stage_seconds', 'Latency of each request stage.', ['stage', 'status'],
+            buckets=LATENCY_BUCKETS)
+        self._tokens = prometheus_client.Histogram(
+            f'{service}_stage_tokens', 'Tokens sent and received by each stage.', ['stage'],
+            buckets=SIZE_BUCKETS)
+        self._bytes = prometheus_client.Histogram(
+            f'{service}_stage_bytes', 'Bytes handled by each stage.', ['stage'],
+            buckets=SIZE_BUCKETS)
+        registry = prometheus_client.REGISTRY
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            from prometheus_client import multiprocess
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        try:
+            prometheus_client.start_http_server(port, registry=registry)
+        except OSError as e:
+            if registry is prometheus_client.REGISTRY:
+                raise RuntimeError(
+                    f"Metrics port {port} is already in use; with several workers, set "
+                    f"PROMETHEUS_MULTIPROC_DIR so one endpoint serves all of them") from e
+            # Another worker already serves the endpoint, which includes this worker's samples
+            logging.info(f"Metrics endpoint already served on port {port}")
+
+    def record(self, stage: str, seconds: float, status: str, counts: dict):
+        self._latency.labels(stage, status).observe(seconds)
+        if 'tokens' in counts:
+            self._tokens.labels(stage).observe(counts['tokens'])
+        if 'bytes' in counts:
+            self._bytes.labels(stage).observe(counts['bytes'])
+
+
+class OpenTelemetryMetrics(Metrics):
+    """Exports histograms and a trace span per stage through the OpenTelemetry API.
+
+    The SDK and its exporters are set up by the environment, e.g. by running
+    under ``opentelemetry-instrument``; without them the API is a no-op.
+
+    Args:
+        service: Name of the service, used as the meter, tracer and metric name prefix.
+    """
+
+    def __init__(self, service: str):
+        from opentelemetry import metrics, trace
+        super().__init__(service)
+        meter = metrics.get_meter(service)
+        self._tracer = trace.get_tracer(service)
+        self._latency = meter.create_histogram(
+            f'{service}.stage.duration', unit='s', description='Latency of each request stage.')
+        self._tokens = meter.create_histogram(
+            f'{service}.stage.tokens', unit='{token}', description='Tokens sent and received by each stage.')
+        self._bytes = meter.create_histogram(
+            f'{service}.stage.bytes', unit='By', description='Bytes handled by each stage.')
+
+    @contextmanager
+    def span(self, stage: str):
+        with self._tracer.start_as_current_span(stage) as trace_span:
+            counts = {}
+            try:
+                with super().span(stage) as counts:
+                    yield counts
+            finally:
+                for name, value in counts.items():
+                    trace_span.set_attribute(name, value)
+
+    def record(self, stage: str, seconds: float, status: str, counts: dict):
+        self._latency.record(seconds, {'stage': stage, 'status': status})
+        if 'tokens' in counts:
+            self._tokens.record(counts['tokens'], {'stage': stage})
+        if 'bytes' in counts:
+            self._bytes.record(counts['bytes'], {'stage': stage})
+
+
+def make_metrics(exporter: str, service: str, port: int = None) -> Metrics:
+    """Builds the metrics recorder for the configured exporter.
+
+    Args:
+        exporter: 'none' for the no-op default, 'prometheus' or 'otel'.
+        service: Name of the service, used as the metric name prefix.
+        port: Port of the Prometheus endpoint, required for 'prometheus'.
+
+    Returns:
+        A Metrics, PrometheusMetrics or OpenTelemetryMetrics.
+    """
+    if exporter == 'prometheus':
+        return PrometheusMetrics(service, port)
+    if exporter == 'otel':
+        return OpenTelemetryMetrics(service)
+    if exporter != 'none':
+        raise ValueError(f"Unknown metrics exporter: {exporter}")
+    return Metrics(service)
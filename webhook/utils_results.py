@@ -0,0 +1,93 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from utils_tokens import estimate_tokens
+
+
+def render_table(table: pa.Table) -> str:
+    """Renders a table as compact pipe-separated text, one line per row.
+
+    Each column is converted to strings in a single vectorized cast, which
+    keeps this fast for large results and the output free of padding. An
+    empty result keeps its header and reads "No rows.".
+    """
+    columns = []
+    for column in table.columns:
+        if pa.types.is_floating(column.type):
+            column = pc.round(column, 2)
+        columns.append(format_column(column))
+    lines = [" | ".join(table.column_names)] if table.num_columns else []
+    if table.num_rows == 0:
+        lines.append("No rows.")
+    lines.extend(" | ".join(row) for row in zip(*columns))
+    return "\n".join(lines)
+
+
+def format_column(column) -> list:
+    """Converts a column to a list of strings, with empty strings for nulls.
+
+    Nested (ARRAY, STRUCT) and BYTES columns have no cast to UTF-8 and are
+    converted value by value instead.
+    """
+    try:
+        return pc.fill_null(pc.cast(column, pa.string()), "").to_pylist()
+    except (pa.ArrowNotImplementedError, pa.ArrowInvalid):
+        return ["" if value is None else str(value) for value in column.to_pylist()]
+
+
+def summarize_table(table: pa.Table) -> str:
+    """Describes each column with aggregates: min, max and mean for numbers, distinct count otherwise."""
+    lines = []
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_decimal(column.type):
+            bounds = pc.min_max(column)
+            mean = pc.mean(column).as_py()
+            if mean is None:
+                lines.append(f"{name}: no values")
+                continue
+            lines.append(f"{name}: min {bounds['min'].as_py()}, max {bounds['max'].as_py()}, mean {mean:.2f}")
+        else:
+            try:
+                distinct = pc.count_distinct(column).as_py()
+            except pa.ArrowNotImplementedError:
+                distinct = len({str(value) for value in column.to_pylist() if value is not None})
+            lines.append(f"{name}: {distinct} distinct values")
+    return "\n".join(lines)
+
+
+def render_results(table: pa.Table, total_rows: int, token_budget: int, top_n: int) -> str:
+    """Renders query results for the prompt, summarizing them if they exceed the token budget.
+
+    Args:
+        table: The fetched rows, possibly capped.
+        total_rows: Number of rows the query returned in total.
+        token_budget: Maximum estimated tokens for the full table.
+        top_n: Rows shown when the results are summarized.
+
+    Returns:
+        str: The full table, or the first `top_n` rows plus aggregates over the fetched rows.
+    """
+    text = render_table(table)
+    if total_rows <= table.num_rows and estimate_tokens(text) <= token_budget:
+        return text
+    return "\n".join([
+        f"{total_rows} rows in total, showing the first {min(top_n, table.num_rows)}:",
+        render_table(table.slice(0, top_n)),
+        f"Aggregates over the first {table.num_rows} rows:",
+        summarize_table(table),
+    ])
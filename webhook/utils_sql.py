@@ -0,0 +1,150 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Dict
+
+import sqlglot
+from sqlglot import exp
+
+
+# Outcomes of SQL generation: answerable, unanswerable (short-circuited) and invalid JSON
+sql_outcomes = Counter()
+sql_outcomes_lock = threading.Lock()
+
+
+class SqlValidationError(Exception):
+    """Raised when generated SQL is rejected before it reaches BigQuery."""
+
+
+def parse_schema_columns(s_columns: str) -> set:
+    """Extracts the column names from a column block built by `format_columns`.
+
+    Args:
+        s_columns: Lines of the form "- name (type)".
+
+    Returns:
+        set: The lowercased column names.
+    """
+    return {name.lower() for name in re.findall(r"^- (\w+) \(", s_columns, re.MULTILINE)}
+
+
+def validate_sql(sql: str, columns: set, project_id: str, dataset: str, table: str) -> str:
+    """Checks that generated SQL is a single read-only query over the known table and columns.
+
+    Args:
+        sql: The generated SQL query.
+        columns: Lowercased column names allowed in the query.
+        project_id: Project of the only table the query may read.
+        dataset: Dataset of the only table the query may read.
+        table: Name of the only table the query may read.
+
+    Returns:
+        str: The SQL query, stripped of surrounding whitespace.
+
+    Raises:
+        SqlValidationError: If the query cannot be parsed or fails a check.
+    """
+    sql = sql.strip()
+    try:
+        statements = [s for s in sqlglot.parse(sql, read='bigquery') if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SqlValidationError(f"The SQL could not be parsed: {e}")
+    if len(statements) != 1:
+        raise SqlValidationError(f"Expected a single statement, got {len(statements)}.")
+    tree = statements[0]
+    if not isinstance(tree, exp.Query):
+        raise SqlValidationError(f"Only SELECT queries are allowed, got {tree.key.upper()}.")
+
+    ctes = {cte.alias.lower() for cte in tree.find_all(exp.CTE)}
+    for ref in tree.find_all(exp.Table):
+        if ref.name.lower() in ctes and not ref.db:
+            continue
+        if (ref.catalog or project_id, ref.db, ref.name) != (project_id, dataset, table):
+            raise SqlValidationError(
+                f"Unknown table {ref.sql(dialect='bigquery')}, use `{project_id}.{dataset}.{table}`.")
+
+    aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    aliases |= {column.name.lower() for table_alias in tree.find_all(exp.TableAlias) for column in table_alias.columns}
+    unknown = sorted({column.name for column in tree.find_all(exp.Column)
+                      if column.name and column.name.lower() not in columns | aliases})
+    if unknown:
+        raise SqlValidationError(f"Unknown columns: {', '.join(unknown)}.")
+    return sql
+
+
+def extract_sql_query(chat_response: str) -> Dict:
+    """Extracts the SQL query from the JSON chat response.
+
+    Responses that are not a JSON object are treated as bare SQL, stripped
+    of code fences, counted as 'invalid_json' and left to the SQL validation to accept or reject.
+
+    Args:
+        chat_response: The response from the chat model, generated with `sql_generation_config`.
+
+    Returns:
+        Dict: The `sql`, `answerable` and `reason` fields.
+    """
+    try:
+        generated = json.loads(chat_response)
+        return {
+            'sql': str(generated.get('sql') or '').strip(),
+            'answerable': bool(generated.get('answerable', True)),
+            'reason': str(generated.get('reason') or '').strip(),
+        }
+    except (ValueError, AttributeError):
+        record_sql_outcome('invalid_json')
+        sql_query = chat_response.replace('```sql', '').replace('```', '').strip()
+        return {'sql': sql_query, 'answerable': True, 'reason': ''}
+
+
+def record_sql_outcome(outcome: str):
+    """Counts an SQL generation outcome and logs the running totals.
+
+    Args:
+        outcome: 'answerable', 'unanswerable' or 'invalid_json'.
+    """
+    with sql_outcomes_lock:
+        sql_outcomes[outcome] += 1
+        totals = dict(sql_outcomes)
+    logging.info(f"SQL generation outcomes: {totals}")
+
+
+def rows_needed(sql: str, default: int) -> int:
+    """Estimates how many result rows are enough to answer, from the shape of the query.
+
+    Args:
+        sql: A validated SQL query.
+        default: Rows needed when the query has no LIMIT and is not a single aggregate.
+
+    Returns:
+        int: The LIMIT of the query, 1 for an aggregate without GROUP BY, or `default`.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read='bigquery')
+    except sqlglot.errors.ParseError:
+        return default
+    limit = tree.args.get('limit')
+    if limit is not None and isinstance(limit.expression, exp.Literal) and not limit.expression.is_string:
+        return int(limit.expression.this)
+    if (isinstance(tree, exp.Select) and not tree.args.get('group') and not tree.find(exp.Window)
+            and all(select.find(exp.AggFunc) for select in tree.expressions)):
+        return 1
+    return default
@@ -0,0 +1,67 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from typing import List, Tuple
+
+# Blocks of a user turn that only matter while that turn is recent
+RESULT_PATTERNS = [
+    re.compile(r"(```).*?(```)", re.DOTALL),
+    re.compile(r"(<catalog_results>).*?(</catalog_results>)", re.DOTALL),
+    re.compile(r"(<documents_summary>).*?(</documents_summary>)", re.DOTALL),
+    re.compile(r"(<information>).*?(</information>)", re.DOTALL),
+]
+RESULT_PLACEHOLDER = "[omitted]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text, about four characters per token."""
+    return len(text) // 4 + 1
+
+
+def compact_turns(turns: List[Tuple[str, str]], token_budget: int, keep_recent: int) -> Tuple[List[Tuple[str, str]], int]:
+    """Compacts a chat history so it fits in a token budget.
+
+    The column block lives in the model's system instruction, so the history
+    only carries questions, answers and the data they were based on. Query
+    results and document summaries of turns older than the last ``keep_recent``
+    messages are replaced with a placeholder, and if the history is still over
+    budget the oldest turns are dropped in whole user/model pairs.
+
+    Args:
+        turns: The history as (role, text) pairs, oldest first.
+        token_budget: Maximum estimated tokens of the compacted history.
+        keep_recent: Number of most recent messages that are never compacted or dropped.
+
+    Returns:
+        tuple: The compacted (role, text) pairs, and how many leading turns were dropped.
+    """
+    recent = len(turns) - keep_recent
+
+    compacted = []
+    for i, (role, text) in enumerate(turns):
+        if role == 'user' and i < recent:
+            for pattern in RESULT_PATTERNS:
+                text = pattern.sub(r"\g<1>" + RESULT_PLACEHOLDER + r"\g<2>", text)
+        compacted.append((role, text))
+
+    sizes = [estimate_tokens(text) for _, text in compacted]
+    total = sum(sizes)
+    dropped = 0
+    while total > token_budget and len(compacted) - dropped > max(keep_recent, 2):
+        total -= sizes[dropped] + sizes[dropped + 1]
+        dropped += 2
+    return compacted[dropped:], dropped
@@ -0,0 +1,272 @@
+# Copyright 2024 Google, LLC. This software is provided as-is, without
+# warranty or representation for any use or purpose. Your use of it is
+# subject to your agreement with Google.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import zlib
+from typing import Callable, Dict, List
+
+import numpy as np
+
+EMBEDDINGS_FILE = 'embeddings.f32'
+CHUNKS_FILE = 'chunks.jsonl'
+MANIFEST_FILE = 'manifest.json'
+
+
+class HashingEmbedder:
+    """Offline embedder hashing word counts into a fixed number of buckets.
+
+    It needs no cloud service, which makes it suitable for tests and local
+    development; retrieval quality is that of a bag-of-words model.
+
+    Args:
+        dim: Number of hash buckets (the embedding size).
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def __call__(self, texts: List[str], task: str = 'RETRIEVAL_DOCUMENT') -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                vectors[row, zlib.crc32(word.encode('utf-8')) % self.dim] += 1
+        return np.log1p(vectors)
+
+
+class VertexEmbedder:
+    """Embedder calling a Vertex AI text embedding model.
+
+    Args:
+        model_name: The embedding model, e.g. `text-embedding-004`.
+        batch_size: Texts sent per request.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16):
+        from vertexai.language_models import TextEmbeddingModel
+
+        self.model = TextEmbeddingModel.from_pretrained(model_name)
+        self.batch_size = batch_size
+        self.name = model_name
+
+    def __call__(self, texts: List[str], task: str = 'RETRIEVAL_DOCUMENT') -> np.ndarray:
+        from vertexai.language_models import TextEmbeddingInput
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [TextEmbeddingInput(text, task) for text in texts[start:start + self.batch_size]]
+            vectors.extend(embedding.values for embedding in self.model.get_embeddings(batch))
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def make_embedder(kind: str, model_name: str = None):
+    """Builds the embedder for the configured kind ('vertex' or 'hashing')."""
+    if kind == 'hashing':
+        return HashingEmbedder()
+    if kind != 'vertex':
+        raise ValueError(f"Unknown embedder: {kind}")
+    return VertexEmbedder(model_name)
+
+
+def extract_chunks(pdf_path: str, chunk_words: int = 200, overlap: int = 40) -> List[Dict]:
+    """Extracts the text of a PDF and splits each page into overlapping word windows.
+
+    Args:
+        pdf_path: Path to the PDF.
+        chunk_words: Words per chunk.
+        overlap: Words shared by consecutive chunks of a page.
+
+    Returns:
+        list: Chunks as dicts with `source`, `page` and `text`.
+    """
+    from pypdf import PdfReader
+
+    source = os.path.basename(pdf_path)
+    chunks = []
+    for page_number, page in enumerate(PdfReader(pdf_path).pages, start=1):
+        words = (page.extract_text() or '').split()
+        for start in range(0, max(len(words) - overlap, 1), chunk_words - overlap):
+            text = ' '.join(words[start:start + chunk_words])
+            if text:
+                chunks.append({'source': source, 'page': page_number, 'text': text})
+    return chunks
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-256 of a file, used to detect changed documents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VectorIndex:
+    """Top-k retrieval over document chunks stored in a memory-mapped float32 matrix.
+
+    The index directory holds the normalized embeddings (`embeddings.f32`, one
+    row per chunk), the chunk texts (`chunks.jsonl`) and a manifest recording
+    which rows belong to which document and its digest, so rebuilding only
+    embeds new or changed documents.
+
+    Args:
+        index_dir: Directory of the index files.
+        embedder: Callable turning a list of texts into a 2-D float32 array.
+    """
+
+    def __init__(self, index_dir: str, embedder: Callable):
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        self.manifest = {'embedder': self.embedder.name, 'dim': 0, 'rows': 0, 'documents': {}}
+        self.chunks = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        if not os.path.exists(self._path(MANIFEST_FILE)):
+            return
+        with open(self._path(MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest['embedder'] != self.embedder.name:
+            logging.warning(f"Index built with {manifest['embedder']}, rebuilding for {self.embedder.name}")
+            return
+        self.manifest = manifest
+        with open(self._path(CHUNKS_FILE)) as f:
+            self.chunks = [json.loads(line) for line in f]
+        if manifest['rows']:
+            self.matrix = np.memmap(self._path(EMBEDDINGS_FILE), dtype=np.float32, mode='r',
+                                    shape=(manifest['rows'], manifest['dim']))
+
+    def _embed(self, texts: List[str], task: str) -> np.ndarray:
+        vectors = np.asarray(self.embedder(texts, task=task), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def update(self, digests: Dict[str, str], load_chunks: Callable[[str], List[Dict]]):
+        """Brings the index in line with a set of documents, embedding only what changed.
+
+        Args:
+            digests: Current documents, mapping name to content digest.
+            load_chunks: Callable returning the chunks of a document by name.
+        """
+        known = self.manifest['documents']
+        removed = [name for name in known if digests.get(name) != known[name]['sha256']]
+        added = [name for name in digests if name not in known or name in removed]
+        if not removed and not added:
+            logging.info("Vector index is up to date")
+            return
+
+        new_chunks, new_documents = [], {}
+        for name in added:
+            chunks = load_chunks(name)
+            new_documents[name] = {'sha256': digests[name], 'count': len(chunks)}
+            new_chunks.extend(chunks)
+        vectors = self._embed([chunk['text'] for chunk in new_chunks], 'RETRIEVAL_DOCUMENT') \
+            if new_chunks else None
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        if removed or not self.manifest['rows']:
+            # Rewrite the files, keeping the rows of unchanged documents
+            keep = {name: doc for name, doc in known.items() if name not in removed}
+            rows = [self.matrix[doc['start']:doc['start'] + doc['count']] for doc in keep.values()]
+            kept_vectors = np.concatenate(rows) if rows else None
+            kept_chunks = []
+            documents, start = {}, 0
+            for name, doc in keep.items():
+                kept_chunks.extend(self.chunks[doc['start']:doc['start'] + doc['count']])
+                documents[name] = {'sha256': doc['sha256'], 'start': start, 'count': doc['count']}
+                start += doc['count']
+            # Release the memory map before the file is truncated
+            del rows
+            self.matrix = None
+            self._write(EMBEDDINGS_FILE, 'wb', kept_vectors)
+            self._write_chunks('w', kept_chunks)
+        else:
+            # Only additions: append to the existing files
+            documents, start = dict(known), self.manifest['rows']
+
+        for name, doc in new_documents.items():
+            documents[name] = {'sha256': doc['sha256'], 'start': start, 'count': doc['count']}
+            start += doc['count']
+        self._write(EMBEDDINGS_FILE, 'ab', vectors)
+        self._write_chunks('a', new_chunks)
+
+        dim = vectors.shape[1] if vectors is not None else self.manifest['dim']
+        self.manifest = {'embedder': self.embedder.name, 'dim': dim, 'rows': start, 'documents': documents}
+        with open(self._path(MANIFEST_FILE), 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        logging.info(f"Vector index updated: {len(added)} documents embedded, {len(removed)} removed, {start} chunks")
+        self._load()
+
+    def _write(self, name: str, mode: str, vectors):
+        with open(self._path(name), mode) as f:
+            if vectors is not None:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+    def _write_chunks(self, mode: str, chunks: List[Dict]):
+        with open(self._path(CHUNKS_FILE), mode) as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+
+    def build(self, papers_dir: str, chunk_words: int = 200, overlap: int = 40):
+        """Indexes the PDFs of a directory, embedding only new or changed files.
+
+        Args:
+            papers_dir: Directory containing the PDFs.
+            chunk_words: Words per chunk.
+            overlap: Words shared by consecutive chunks of a page.
+        """
+        paths = {name: os.path.join(papers_dir, name)
+                 for name in sorted(os.listdir(papers_dir)) if name.lower().endswith('.pdf')}
+        digests = {name: file_digest(path) for name, path in paths.items()}
+        self.update(digests, lambda name: extract_chunks(paths[name], chunk_words, overlap))
+
+    def search(self, query: str, k: int = 5) -> List[Dict]:
+        """Returns the `k` chunks most similar to a query.
+
+        Args:
+            query: The search query.
+            k: Number of chunks returned.
+
+        Returns:
+            list: Chunks with an added cosine similarity `score`, best first.
+        """
+        if not self.manifest['rows']:
+            return []
+        scores = self.matrix @ self._embed([query], 'RETRIEVAL_QUERY')[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.chunks[i], score=float(scores[i])) for i in top]
+
+
+if __name__ == '__main__':
+    # Build or refresh the index offline: python utils_vector.py build
+    from configs import VECTOR_INDEX_DIR, VECTOR_PAPERS_DIR, VECTOR_EMBEDDER, VECTOR_EMBEDDING_MODEL
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ['build']:
+        sys.exit("Usage: python utils_vector.py build")
+    index = VectorIndex(VECTOR_INDEX_DIR, make_embedder(VECTOR_EMBEDDER, VECTOR_EMBEDDING_MODEL))
+    index.build(VECTOR_PAPERS_DIR)